@@ -14,8 +14,12 @@
     使用方法：
     1.input: SequenceDataPanel，SequenceDataPanel是二维数组，以numpy为底层，numpy的函数都可以用
     2.output: 一维数组，对应传入的SequenceDataPanel最新的计算结果，每调用一次计算函数输出一行（一维数组）
+    3.每个bar都要计算的长窗口统计量可使用rollingCalculator中的有状态版本，计算量与窗口长度无关
+    4.加权函数的权值按参数缓存，只在第一次调用时计算
 '''
 
+from functools import lru_cache
+
 import numpy as np
 
 
@@ -68,20 +72,46 @@ def Min(x, num, minobs=0):
     return raw
 
 
-def Median(x, num, minobs=0):
-    raw = x[-num:, :]
-    rowlen = raw.shape[0]
-    rawSort = np.sort(raw, axis=0)
-    if rowlen % 2 == 0:
-        row1 = rowlen / 2 - 1
-        row2 = rowlen / 2
-        raw = (rawSort[row1, :] + rawSort[row2, :]) / 2
+def Quantile(x, num, q, minobs=0, skipna=False):
+    """
+    窗口期内每列的分位数，两个位置之间线性插值，与np.quantile一致
+    :param q: 分位点，0到1之间
+    :param minobs: 非nan值少于minobs的列返回nan
+    :param skipna: False时窗口内有nan的列返回nan；True时只使用非nan值，需要对窗口排序；
+                   None时nan视为最大值排在最后，按整个窗口的位置取值，取到nan时返回nan
+    """
+    raw = np.asarray(x[-num:, :], dtype=np.float64)
+    nans = np.isnan(raw).sum(axis=0)
+    valid = raw.shape[0] - nans
+    if skipna:
+        rawSort = np.sort(raw, axis=0)  # nan排在最后
+        h = np.maximum(valid - 1, 0) * q
+        lo = np.floor(h).astype(np.int64)
+        hi = np.ceil(h).astype(np.int64)
+        cols = np.arange(raw.shape[1])
+        loValue, hiValue = rawSort[lo, cols], rawSort[hi, cols]
     else:
-        row = int((rowlen + 1) / 2 - 1)
-        raw = rawSort[row, :]
+        h = (raw.shape[0] - 1) * q
+        lo, hi = int(np.floor(h)), int(np.ceil(h))
+        rawPart = np.partition(raw, hi, axis=0)  # 第hi行就位, 之前的行都不大于它
+        hiValue = rawPart[hi]
+        loValue = rawPart[:hi].max(axis=0) if lo < hi else hiValue
+    raw = loValue + (hiValue - loValue) * (h - lo)
+    invalid = valid < max(minobs, 1)
+    if skipna is False:
+        invalid |= nans > 0
+    raw[invalid] = np.nan
     return raw
 
 
+def Median(x, num, minobs=0, skipna=None):
+    """
+    窗口期内每列的中位数，偶数个值时取中间两个值的平均
+    默认skipna=None，与原先np.sort后取中间行一致，nan排在最后，nan个数较少时仍返回中位数
+    """
+    return Quantile(x, num, 0.5, minobs=minobs, skipna=skipna)
+
+
 def Mean(x, num, minobs=0):
     raw = x[-num:, :].mean(axis=0)
     return raw
@@ -117,6 +147,7 @@ def Skew(x, num, minobs=0):
     计算偏度
     三阶中心距除以标准差的三次方
     '''
+    x = x[-num:, :]  # 只对窗口内的数据去均值
     std3 = Std(x=x, num=num, minobs=minobs) ** 3  # 计算标准差的三次方
     mean = Mean(x=x, num=num, minobs=minobs)  # 计算期望
     cd3 = Mean((x - mean) ** 3, num)  # 计算三阶中心距
@@ -129,6 +160,7 @@ def Kurt(x, num, minobs=0):
     计算峰度
     四阶中心距与标准差四次方的比值减去3
     '''
+    x = x[-num:, :]  # 只对窗口内的数据去均值
     std4 = Std(x=x, num=num, minobs=minobs) ** 4  # 计算标准差的四次方
     mean = Mean(x=x, num=num, minobs=minobs)  # 计算期望
     cd4 = Mean((x - mean) ** 4, num)  # 计算四阶中心距
@@ -146,28 +178,62 @@ def Sumif(x, condition, num, minobs=0):
     return raw
 
 
+@lru_cache(maxsize=None)
+def SmaWeights(n, m):
+    '''
+    Sma的权值，依次对应窗口内从早到晚的各行，同一组(n, m)只计算一次
+    与原有的逐行计算一致：窗口第i行的权值为前i个(n-j-m)/(n-j)的乘积再乘以m/(n-i)，第0行为m/n
+    '''
+    assert n >= m
+    num = n - m + 1
+    i = np.arange(num)
+    alpha1 = np.concatenate([[1], np.cumprod((n - i[:-1] - m) / (n - i[:-1]))])  # 权值的前部
+    alpha2 = m / (n - i)  # 权值的后部
+    alpha = alpha1 * alpha2
+    alpha.setflags(write=False)
+    return alpha
+
+
+@lru_cache(maxsize=None)
+def WmaWeights(num, pct, weightType):
+    '''
+    Wma的权值，按时间从早到晚排列，同一组参数只计算一次
+    '''
+    if weightType == 'exp':
+        weights = pct ** np.arange(num - 1, -1, -1, dtype=np.float64)
+    elif weightType == 'halflife':
+        rate = -np.log(2) / pct
+        weights = np.exp(rate * np.arange(num - 1, -1, -1))
+    else:
+        raise NotImplementedError
+    weights.setflags(write=False)
+    return weights
+
+
+@lru_cache(maxsize=None)
+def DecayWeights(n):
+    '''
+    Decaylinear的权值1,2,…,n除以权值和，按时间从早到晚排列，同一个n只计算一次
+    '''
+    alpha = np.arange(1, n + 1) / (n * (n + 1) / 2)
+    alpha.setflags(write=False)
+    return alpha
+
+
+def WeightedSum(x, weights):
+    '''
+    窗口内按时间从早到晚的权值加权求和，数据不足窗口长度时与原有实现一样抛出ValueError
+    '''
+    return np.dot(weights, x[-len(weights):, :])
+
+
 def Sma(x, n, m):
     '''
     加权移动平均数,x为输入的属性，n为计算所需数据最大长度，m为权值，n-m+1为实际所需数据长度
     Sma(x(t),n,m)=m/n*x+(n-m)/n*Sma(x(t-1),n-1,m)
     计算思路，先计算各值对应的权值alpha，然后用权值乘对应的属性值
     '''
-    assert n >= m
-    num = n - m + 1
-    x = x[-num:, :]
-    alpha1 = np.zeros(shape=num)
-    alpha2 = np.zeros(shape=num)
-    alpha1[0] = 1
-    for i in range(1, num):
-        alpha1[i] = alpha1[i - 1] * (n - (i - 1) - m) / (n - (i - 1))  # 权值的前部
-    for i in range(num):
-        alpha2[i] = m / (n - i)  # 权值的后部
-    alpha = alpha1 * alpha2
-    xT = x.T
-    rawT = xT * alpha
-    raw = rawT.T
-    raw = raw.sum(axis=0)
-    return raw
+    return WeightedSum(x, SmaWeights(n, m))
 
 
 def Wma(x, num, pct, weightType=False, minobs=0):
@@ -180,21 +246,7 @@ def Wma(x, num, pct, weightType=False, minobs=0):
     :param minobs:
     :return:
     """
-    if weightType == 'exp':
-        weights = pct ** np.array((range(num - 1, -1, -1)))
-        toWeight = (1 - pct ** num) / (1 - pct)
-    elif weightType == 'halflife':
-        rate = -np.log(2) / pct
-        weights = np.exp(rate * np.array(range(num - 1, -1, -1)))
-        toWeight = np.sum(weights)
-    else:
-        raise NotImplementedError
-    x = x[-num:, :]
-    x = x.T
-    rawT = x * weights
-    raw = rawT.T
-    raw = raw.sum(axis=0)
-    return raw
+    return WeightedSum(x, WmaWeights(num, pct, weightType))
 
 
 def Decaylinear(x, n):
@@ -202,31 +254,33 @@ def Decaylinear(x, n):
     对 A 序列计算移动平均加权
     权重对应 d,d-1,…,1/ sum(1-d)（权重和为 1）
     """
-    x = x[-n:, :]
-    dsum = sum(np.array(range(1, n + 1)))
-    alpha = np.zeros(shape=n)
-    for i in range(1, n + 1):
-        alpha[i - 1] = i / dsum
-    xT = x.T
-    rawT = xT * alpha
-    raw = rawT.T
-    raw = raw.sum(axis=0)
-    return raw
+    return WeightedSum(x, DecayWeights(n))
+
+
+def TsExtremum(x, num, isMax=True):
+    """
+    同时计算窗口期内每列的最大(小)值及其距当前的间隔数, 当前值本身也算一位
+    出现相同值时，取间隔小的；nan不参与比较，全为nan的列返回nan
+    :return: value, position
+    """
+    x = np.asarray(x[-num:, :], dtype=np.float64)
+    fill = -np.inf if isMax else np.inf
+    filled = np.where(np.isnan(x), fill, x)[::-1]  # 倒序后argmax/argmin取到的是最近的位置
+    idx = filled.argmax(axis=0) if isMax else filled.argmin(axis=0)
+    cols = np.arange(x.shape[1])
+    value = filled[idx, cols]
+    position = idx + 1.0
+    empty = np.isnan(x).all(axis=0)
+    value[empty] = np.nan
+    position[empty] = np.nan
+    return value, position
 
 
 def TsToMin(x, num, minobs=0):
     """
     计算输入的x前num行每列数据中最小值所处的位置,出现相同值时，取间隔小的
     """
-    x = x[-num:, :]
-    collen = x.shape[1]
-    raw = np.zeros(shape=collen)
-    for i in range(collen):
-        colmin = x[:, i].min()
-        minIdx = np.where(x[:, i] == colmin)
-        minIdx = minIdx[0][-1]
-        raw[i] = raw.shape[0] - minIdx
-    return raw
+    return TsExtremum(x, num, isMax=False)[1]
 
 
 def TsToMax(x, num, minobs=0):
@@ -234,45 +288,119 @@ def TsToMax(x, num, minobs=0):
     计算 当前值 距离窗口期内最大值之间的间隔数, 当前值本身也算一位
     当出现相同值时，取间隔小的
     """
-    x = x[-num:, :]
-    collen = x.shape[1]
-    raw = np.zeros(shape=collen)
-    for i in range(collen):
-        colmin = x[:, i].max()
-        maxIdx = np.where(x[:, i] == colmin)
-        maxIdx = maxIdx[0][-1]
-        raw[i] = raw.shape[0] - maxIdx
-    return raw
+    return TsExtremum(x, num, isMax=True)[1]
+
+
+def tieRank(less, equal, denseLess, valid, distinct, nans, isNan, method='min', naOption='keep', pct=False):
+    """
+    由比较计数得到排名，最小值排名为1
+    :param less: 严格小于该值的非nan值个数
+    :param equal: 与该值相等的值个数（包括自身）
+    :param denseLess: 严格小于该值的不同非nan值个数
+    :param valid: 参与排名的非nan值个数
+    :param distinct: 参与排名的不同非nan值个数
+    :param nans: 参与排名的nan个数
+    :param isNan: 需要排名的值是否为nan
+    :param method: 相同值的排名方式，min取最小排名，max取最大排名，average取平均排名，dense为不跳号的排名
+    :param naOption: keep为nan不参与排名并返回nan，top为nan排在最前，bottom为nan排在最后
+    :param pct: 是否返回百分比排名，即排名除以参与排名的个数（dense时除以不同值的个数）
+    """
+    less = np.asarray(less, dtype=np.float64)
+    equal = np.asarray(equal, dtype=np.float64)
+    denseLess = np.asarray(denseLess, dtype=np.float64)
+    hasNan = nans > 0
+    if naOption == 'top':  # nan视为最小的一组相同值
+        less = np.where(isNan, 0, less + nans)
+        denseLess = np.where(isNan, 0, denseLess + hasNan)
+    elif naOption == 'bottom':  # nan视为最大的一组相同值
+        less = np.where(isNan, valid, less)
+        denseLess = np.where(isNan, distinct, denseLess)
+    elif naOption != 'keep':
+        raise ValueError("naOption must be 'keep', 'top' or 'bottom'")
+    if naOption != 'keep':
+        equal = np.where(isNan, nans, equal)
+        valid = valid + nans
+        distinct = distinct + hasNan
+
+    if method == 'min':
+        rank = less + 1
+    elif method == 'max':
+        rank = less + equal
+    elif method == 'average':
+        rank = less + (equal + 1) / 2
+    elif method == 'dense':
+        rank = denseLess + 1
+    else:
+        raise ValueError("method must be 'min', 'max', 'average' or 'dense'")
+    if pct:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rank = rank / (distinct if method == 'dense' else valid)
+    if naOption == 'keep':
+        rank = np.where(isNan, np.nan, rank)
+    return rank
 
 
-def FindRank(x, num, minobs=0, pct=False):
+def FindRank(x, num, minobs=0, pct=False, method='min', naOption='keep'):
     """
     计算当前值在过去n天的顺序排位，最小值排名为1
+    对所有列同时按比较计数排名，每列的计算量为O(num)，dense排名需要先排序
+    :param minobs: 窗口内非nan值少于minobs的列返回nan
+    :param method: 相同值的排名方式，min/max/average/dense，默认min与原实现一致
+    :param naOption: keep/top/bottom，见tieRank
     """
-    xNow = x[-1:, :]
-    x = x[-num:, :]
-    x = np.sort(x, axis=0)  # 对x进行排序并生成新的二维数组
-    col = xNow.shape[1]
-    raw = np.zeros(shape=col)
-    for i in range(col):  # 在排序后的列表中寻找当前值的序列
-        xi = xNow[0, i]
-        xrank = np.where(x[:, i] == xi)[0][0]  # 取出序列值
-        raw[i] = xrank + 1
+    x = np.asarray(x[-num:, :], dtype=np.float64)
+    xNow = x[-1, :]
+    isNan = np.isnan(xNow)
+    valid = (~np.isnan(x)).sum(axis=0)
+    nans = x.shape[0] - valid
+    less = (x < xNow).sum(axis=0)
+    equal = np.where(isNan, nans, (x == xNow).sum(axis=0))
+    if method == 'dense':
+        xSort = np.sort(x, axis=0)  # nan排在最后
+        first = ~np.isnan(xSort)
+        first[1:] &= xSort[1:] != xSort[:-1]  # 每组相同值的第一个
+        denseLess = (first & (xSort < xNow)).sum(axis=0)
+        distinct = first.sum(axis=0)
+    else:
+        denseLess = distinct = np.zeros(x.shape[1])
+    raw = tieRank(less, equal, denseLess, valid, distinct, nans, isNan, method, naOption, pct)
+    raw[valid < minobs] = np.nan
     return raw
 
 
-def Rank(x):
+def RankRow(x, method='min', naOption='keep', pct=False):
+    """
+    对一维数组排序一次后得到每个值的排名，计算量为O(N log N)
+    :param method: 相同值的排名方式，min/max/average/dense
+    :param naOption: keep/top/bottom，见tieRank
+    """
+    x = np.asarray(x, dtype=np.float64)
+    isNan = np.isnan(x)
+    nans = isNan.sum()
+    valid = len(x) - nans
+    order = np.argsort(x, kind='stable')[:valid]  # nan排在最后
+    xSort = x[order]
+    first = np.ones(valid, dtype=bool)
+    first[1:] = xSort[1:] != xSort[:-1]
+    group = np.cumsum(first) - 1  # 排序后每个值所在的组
+    starts = np.flatnonzero(first)
+    sizes = np.diff(np.append(starts, valid))
+    less = np.zeros(len(x))
+    equal = np.zeros(len(x))
+    denseLess = np.zeros(len(x))
+    less[order] = starts[group]
+    equal[order] = sizes[group]
+    denseLess[order] = group
+    return tieRank(less, equal, denseLess, valid, len(starts), nans, isNan, method, naOption, pct)
+
+
+def Rank(x, method='min', naOption='keep', pct=False):
     """
     不应再时间序列排序中使用该函数，应用于截面排序（升序）。对x进行排序获得新数组，再取得值在新数组的排列次序
+    :param method: 相同值的排名方式，min/max/average/dense，默认min与原实现一致
+    :param naOption: keep/top/bottom，见tieRank
     """
-    x = x[-1, :]
-    xSort = np.sort(x)
-    col = len(x)
-    rank = np.zeros(shape=col)
-    for i in range(col):
-        rank[i] = np.where(xSort == x[i])[0][0] + 1
-    raw = rank
-    return raw
+    return RankRow(x[-1, :], method, naOption, pct)
 
 
 def Corr(x, y, num, minobs=2):
@@ -0,0 +1,772 @@
+# coding=utf8
+'''
+    rollingCalculator.py
+    描述：有状态的滚动窗口计算，与panelCalculator中的同名函数结果一致
+    使用方法：
+    1.每个bar调用一次update传入最新一行（一维数组，每列对应一个instrument），最新一行被修改时调用replace
+    2.计算量只与进入和离开窗口的两行有关，与窗口长度无关
+    3.skipna=False时窗口内有nan的列输出nan，与panelCalculator一致；skipna=True时只使用非nan值，有效值少于minobs的列输出nan
+'''
+
+import numpy as np
+
+
+class RollingWindow:
+    '''
+    固定长度的窗口缓存，按行保存最近num个bar，用于取出离开窗口的值
+    '''
+
+    def __init__(self, num):
+        self.num = num
+        self.buffer = None
+        self.pos = 0  # 下一行写入的位置
+        self.count = 0  # 累计写入的行数
+
+    def __len__(self):
+        return min(self.count, self.num)
+
+    def isFull(self):
+        return self.count >= self.num
+
+    def push(self, values):
+        '''
+        :param values: 最新一行
+        :return: 离开窗口的一行，窗口未满时返回None
+        '''
+        if self.buffer is None:
+            self.buffer = np.full((self.num, len(values)), np.nan)
+        leaving = self.buffer[self.pos].copy() if self.isFull() else None
+        self.buffer[self.pos] = values
+        self.pos = (self.pos + 1) % self.num
+        self.count += 1
+        return leaving
+
+    def replace(self, values):
+        '''
+        替换最新一行
+        :return: 被替换的一行
+        '''
+        last = (self.pos - 1) % self.num
+        old = self.buffer[last].copy()
+        self.buffer[last] = values
+        return old
+
+    def values(self):
+        '''
+        :return: 窗口内的全部数据，按时间从早到晚排列
+        '''
+        if not self.isFull():
+            return self.buffer[:self.count]
+        return np.concatenate([self.buffer[self.pos:], self.buffer[:self.pos]])
+
+
+class RollingMoments:
+    '''
+    滚动窗口的均值、方差、偏度、峰度
+    按列保存窗口内非nan值的个数、nan的个数以及(x - shift)的1至order阶幂和，shift取最近一次重算时的窗口均值，
+    每num次更新用窗口数据重算一次幂和，避免累计误差
+    '''
+
+    def __init__(self, num, order=2, skipna=False, minobs=0, recompute=None):
+        '''
+        :param num: 窗口长度
+        :param order: 需要的最高阶矩, 均值为1, 方差为2, 偏度为3, 峰度为4
+        :param skipna: 是否跳过nan
+        :param minobs: skipna=True时最少的有效值个数
+        :param recompute: 每更新多少次重算一次幂和, None则取num
+        '''
+        assert 1 <= order <= 4
+        self.num = num
+        self.order = order
+        self.skipna = skipna
+        self.minobs = minobs
+        self.recompute = num if recompute is None else recompute
+        self.window = RollingWindow(num)
+        self.shift = None
+        self.sums = None  # 第k行为k+1阶幂和
+        self.valid = None  # 窗口内非nan值的个数
+        self.nans = None  # 窗口内nan的个数
+        self.scale = None  # 上次重算以来(x - shift)平方的最大值, 决定幂和累计误差的量级
+        self.updates = 0
+
+    def accumulate(self, values, sign):
+        isValid = ~np.isnan(values)
+        d = np.where(isValid, values - self.shift, 0)
+        self.valid += sign * isValid
+        self.nans += sign * ~isValid
+        self.scale = np.maximum(self.scale, d * d)
+        p = d.copy()
+        for k in range(self.order):
+            self.sums[k] += sign * p
+            p *= d
+
+    def reset(self):
+        '''
+        用窗口内的数据重算全部状态, shift移到窗口均值
+        '''
+        data = self.window.values()
+        isValid = ~np.isnan(data)
+        self.valid = isValid.sum(axis=0)
+        self.nans = len(data) - self.valid
+        total = np.where(isValid, data, 0).sum(axis=0)
+        self.shift = np.divide(total, self.valid, out=np.zeros(data.shape[1]), where=self.valid > 0)
+        d = np.where(isValid, data - self.shift, 0)
+        self.scale = (d * d).max(axis=0)
+        p = d.copy()
+        self.sums = np.zeros((self.order, data.shape[1]))
+        for k in range(self.order):
+            self.sums[k] = p.sum(axis=0)
+            p *= d
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        leaving = self.window.push(values)
+        self.updates += 1
+        if self.sums is None or self.updates % self.recompute == 0:
+            self.reset()
+            return self
+        self.accumulate(values, 1)
+        if leaving is not None:
+            self.accumulate(leaving, -1)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用
+        :param values: 修改后的最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        old = self.window.replace(values)
+        self.accumulate(old, -1)
+        self.accumulate(values, 1)
+        return self
+
+    def getMask(self):
+        '''
+        :return: 需要输出nan的列
+        '''
+        mask = self.valid < max(self.minobs, 1)
+        if not self.skipna:
+            mask |= self.nans > 0
+        return mask
+
+    def centralMoments(self):
+        '''
+        :return: 均值以及2至order阶中心矩(除以有效值个数)
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = self.valid
+            e = [self.sums[k] / n for k in range(self.order)]  # (x - shift)的各阶原点矩
+            m = e[0]
+            moments = [self.shift + m]
+            if self.order >= 2:
+                moments.append(np.maximum(e[1] - m ** 2, 0))
+            if self.order >= 3:
+                moments.append(e[2] - 3 * m * e[1] + 2 * m ** 3)
+            if self.order >= 4:
+                moments.append(e[3] - 4 * m * e[2] + 6 * m ** 2 * e[1] - 3 * m ** 4)
+        mask = self.getMask()
+        for moment in moments:
+            moment[mask] = np.nan
+        return moments
+
+    def getFlatMask(self, m2):
+        '''
+        :param m2: 二阶中心矩
+        :return: 二阶中心矩在累计误差范围内为0的列, 即窗口内的值全部相同
+                 增量更新后三、四阶矩残留浮点误差, 这些列的偏度、峰度与panelCalculator一致输出nan, 而不是±inf
+        '''
+        return m2 <= 8 * self.num * np.finfo(np.float64).eps * self.scale
+
+    def mean(self):
+        return self.centralMoments()[0]
+
+    def sum(self):
+        '''
+        与panelCalculator.Sum一致, 为num倍的均值
+        '''
+        return self.num * self.mean()
+
+    def var(self, ddof=0):
+        '''
+        :param ddof: 0为有效估计, 与panelCalculator.Var一致; 1为无偏估计
+        '''
+        m2 = self.centralMoments()[1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return m2 * self.valid / (self.valid - ddof)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.var(ddof))
+
+    def skew(self):
+        '''
+        三阶中心距除以标准差的三次方
+        '''
+        moments = self.centralMoments()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw = moments[2] / moments[1] ** 1.5
+        raw[self.getFlatMask(moments[1])] = np.nan
+        return raw
+
+    def kurt(self):
+        '''
+        四阶中心距与标准差四次方的比值减去3
+        '''
+        moments = self.centralMoments()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw = moments[3] / moments[1] ** 2 - 3
+        raw[self.getFlatMask(moments[1])] = np.nan
+        return raw
+
+
+class RollingCorr:
+    '''
+    两个panel滚动窗口的协方差与相关系数, 只使用两者同时非nan的值
+    '''
+
+    def __init__(self, num, skipna=False, minobs=2, recompute=None):
+        self.num = num
+        self.skipna = skipna
+        self.minobs = minobs
+        self.recompute = num if recompute is None else recompute
+        self.xWindow = RollingWindow(num)
+        self.yWindow = RollingWindow(num)
+        self.shift = None  # (x的shift, y的shift)
+        self.sums = None  # x, y, xx, yy, xy 的幂和
+        self.valid = None
+        self.nans = None
+        self.updates = 0
+
+    def accumulate(self, x, y, sign):
+        isValid = ~(np.isnan(x) | np.isnan(y))
+        dx = np.where(isValid, x - self.shift[0], 0)
+        dy = np.where(isValid, y - self.shift[1], 0)
+        self.valid += sign * isValid
+        self.nans += sign * ~isValid
+        self.sums += sign * np.array([dx, dy, dx * dx, dy * dy, dx * dy])
+
+    def reset(self):
+        x, y = self.xWindow.values(), self.yWindow.values()
+        isValid = ~(np.isnan(x) | np.isnan(y))
+        self.valid = isValid.sum(axis=0)
+        self.nans = len(x) - self.valid
+        shift = []
+        for data in (x, y):
+            total = np.where(isValid, data, 0).sum(axis=0)
+            shift.append(np.divide(total, self.valid, out=np.zeros(data.shape[1]), where=self.valid > 0))
+        self.shift = shift
+        dx = np.where(isValid, x - shift[0], 0)
+        dy = np.where(isValid, y - shift[1], 0)
+        self.sums = np.array([dx.sum(axis=0), dy.sum(axis=0), (dx * dx).sum(axis=0),
+                              (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)])
+
+    def update(self, x, y):
+        '''
+        :param x: x的最新一行
+        :param y: y的最新一行
+        :return: self
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        xLeaving = self.xWindow.push(x)
+        yLeaving = self.yWindow.push(y)
+        self.updates += 1
+        if self.sums is None or self.updates % self.recompute == 0:
+            self.reset()
+            return self
+        self.accumulate(x, y, 1)
+        if xLeaving is not None:
+            self.accumulate(xLeaving, yLeaving, -1)
+        return self
+
+    def replace(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.accumulate(self.xWindow.replace(x), self.yWindow.replace(y), -1)
+        self.accumulate(x, y, 1)
+        return self
+
+    def covVar(self):
+        '''
+        :return: 协方差, x的方差, y的方差, 均为有效估计
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = self.valid
+            mx, my = self.sums[0] / n, self.sums[1] / n
+            cov = self.sums[4] / n - mx * my
+            xVar = np.maximum(self.sums[2] / n - mx ** 2, 0)
+            yVar = np.maximum(self.sums[3] / n - my ** 2, 0)
+        mask = self.valid < max(self.minobs, 1)
+        if not self.skipna:
+            mask |= self.nans > 0
+        for value in (cov, xVar, yVar):
+            value[mask] = np.nan
+        return cov, xVar, yVar
+
+    def cov(self):
+        return self.covVar()[0]
+
+    def corr(self):
+        cov, xVar, yVar = self.covVar()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cov / np.sqrt(xVar * yVar)
+
+
+class RollingExtremum:
+    '''
+    滚动窗口的最大(小)值及其距当前的间隔数, 与panelCalculator.TsExtremum一致
+    每列维护一个单调队列, 全部列的队列存放在同一个 num × N 的环形数组中, 每个bar的出队、入队对所有列向量化进行,
+    每个值最多入队出队各一次, 均摊计算量为O(N); 最新一行被修改时撤销上一次入队后重新入队, 同样为O(N)
+    '''
+
+    def __init__(self, num, isMax=True):
+        '''
+        :param num: 窗口长度
+        :param isMax: True为最大值, False为最小值
+        '''
+        self.num = num
+        self.isMax = isMax
+        self.values = None  # 队列中的值, 最小值时取相反数, nan记为-inf
+        self.indices = None  # 队列中的值对应的bar序号
+        self.head = None
+        self.size = None
+        self.count = 0  # 已经更新的bar数
+        self.lastState = None  # 上一次入队前的队首、队列长度以及被覆盖位置的值, 用于撤销入队
+
+    def clear(self, cols):
+        self.values = np.full((self.num, cols), -np.inf)
+        self.indices = np.zeros((self.num, cols), dtype=np.int64)
+        self.head = np.zeros(cols, dtype=np.int64)
+        self.size = np.zeros(cols, dtype=np.int64)
+        self.count = 0
+        self.lastState = None
+
+    def push(self, values):
+        cols = np.arange(len(values))
+        signed = values if self.isMax else -values
+        signed = np.where(np.isnan(signed), -np.inf, signed)
+        head, size = self.head.copy(), self.size.copy()
+
+        # 队首已经离开窗口的列出队, 窗口每次只前进一位, 每列最多出队一个
+        expired = (self.size > 0) & (self.indices[self.head, cols] <= self.count - self.num)
+        self.head[expired] = (self.head[expired] + 1) % self.num
+        self.size[expired] -= 1
+
+        # 队尾不大于新值的元素出队, 相同值保留最新的
+        while True:
+            tail = (self.head + self.size - 1) % self.num
+            smaller = (self.size > 0) & (self.values[tail, cols] <= signed)
+            if not smaller.any():
+                break
+            self.size[smaller] -= 1
+
+        # 出队只移动队首和长度, 环形数组中只有新值写入的位置被覆盖
+        tail = (self.head + self.size) % self.num
+        self.lastState = (head, size, tail, self.values[tail, cols], self.indices[tail, cols])
+        self.values[tail, cols] = signed
+        self.indices[tail, cols] = self.count
+        self.size += 1
+        self.count += 1
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if self.values is None:
+            self.clear(len(values))
+        self.push(values)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用, 撤销上一次入队, 恢复被新值挤出队尾和队首的元素后重新入队
+        :return: self
+        '''
+        if self.lastState is None:
+            return self.update(values)
+        values = np.asarray(values, dtype=np.float64)
+        head, size, tail, lastValues, lastIndices = self.lastState
+        cols = np.arange(len(values))
+        self.values[tail, cols] = lastValues
+        self.indices[tail, cols] = lastIndices
+        self.head, self.size = head, size
+        self.count -= 1
+        self.push(values)
+        return self
+
+    def value(self):
+        '''
+        :return: 窗口内的最大(小)值
+        '''
+        cols = np.arange(len(self.head))
+        value = self.values[self.head, cols]
+        value = np.where(np.isinf(value) & (value < 0), np.nan, value)
+        return value if self.isMax else -value
+
+    def position(self):
+        '''
+        :return: 最大(小)值距当前的间隔数, 当前值本身也算一位
+        '''
+        cols = np.arange(len(self.head))
+        position = (self.count - self.indices[self.head, cols]).astype(np.float64)
+        position[np.isnan(self.value())] = np.nan
+        return position
+
+
+class RollingQuantile:
+    '''
+    滚动窗口的分位数, 与panelCalculator.Quantile一致
+    每列维护窗口内排好序的值, nan和窗口未满的位置记为inf排在最后; 有序数组按 N × num 存放, 每列连续
+    每个bar用向量化的二分查找找到离开和进入窗口的值的位置, 只移动两个位置之间的值,
+    全部列需要移动的值拼成一个索引一次完成
+    '''
+
+    def __init__(self, num, skipna=False, minobs=0):
+        '''
+        :param num: 窗口长度
+        :param skipna: False时窗口内有nan的列输出nan; True时只使用非nan值
+        :param minobs: 非nan值少于minobs的列输出nan
+        '''
+        self.num = num
+        self.skipna = skipna
+        self.minobs = minobs
+        self.window = RollingWindow(num)
+        self.sorted = None  # N × num
+        self.base = None  # 每列在展开后的有序数组中的起始位置
+        self.nans = None
+
+    def searchSorted(self, values):
+        '''
+        :return: 每列中第一个不小于values的位置
+        '''
+        flat = self.sorted.ravel()
+        lo = np.zeros(len(values), dtype=np.int64)
+        hi = np.full(len(values), self.num, dtype=np.int64)
+        while True:
+            active = lo < hi
+            if not active.any():
+                return lo
+            mid = (lo + hi) // 2
+            right = flat[self.base + np.minimum(mid, self.num - 1)] < values
+            lo = np.where(active & right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+
+    def move(self, leaving, entering):
+        '''
+        从每列的有序数组中删除leaving, 再插入entering
+        '''
+        leaving = np.where(np.isnan(leaving), np.inf, leaving)
+        entering = np.where(np.isnan(entering), np.inf, entering)
+        removeAt = self.searchSorted(leaving)
+        insertAt = self.searchSorted(entering) - (leaving < entering)  # 删除leaving之后的插入位置
+        flat = self.sorted.ravel()
+        # removeAt < insertAt时(removeAt, insertAt]的值前移一位, removeAt > insertAt时[insertAt, removeAt)的值后移一位
+        forward = np.maximum(insertAt - removeAt, 0)
+        target = self.bandIndex(removeAt, forward)
+        flat[target] = flat[target + 1]
+        backward = np.maximum(removeAt - insertAt, 0)
+        target = self.bandIndex(insertAt + 1, backward)
+        flat[target] = flat[target - 1]
+        flat[self.base + insertAt] = entering
+
+    def bandIndex(self, start, lengths):
+        '''
+        :return: 每列从start开始、长度为lengths的区间在展开后的有序数组中的位置, 拼接为一个数组
+        '''
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(offsets[-1] + lengths[-1]) + np.repeat(self.base + start - offsets, lengths)
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if self.sorted is None:
+            self.sorted = np.full((len(values), self.num), np.inf)
+            self.base = np.arange(len(values)) * self.num
+            self.nans = np.zeros(len(values), dtype=np.int64)
+        leaving = self.window.push(values)
+        self.nans += np.isnan(values)
+        if leaving is None:
+            leaving = np.full(len(values), np.inf)  # 窗口未满时删除一个末尾的inf
+        else:
+            self.nans -= np.isnan(leaving)
+        self.move(leaving, values)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        old = self.window.replace(values)
+        self.nans += np.isnan(values).astype(np.int64) - np.isnan(old)
+        self.move(old, values)
+        return self
+
+    def quantile(self, q):
+        '''
+        :param q: 分位点，0到1之间
+        '''
+        valid = len(self.window) - self.nans
+        h = np.maximum(valid - 1, 0) * q
+        lo = np.floor(h).astype(np.int64)
+        hi = np.ceil(h).astype(np.int64)
+        flat = self.sorted.ravel()
+        with np.errstate(invalid='ignore'):
+            value = flat[self.base + lo] + (flat[self.base + hi] - flat[self.base + lo]) * (h - lo)
+        invalid = valid < max(self.minobs, 1)
+        if not self.skipna:
+            invalid |= self.nans > 0
+        value[invalid] = np.nan
+        return value
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class ExponentialFilter:
+    '''
+    递归的指数加权平均 y(t) = alpha * x(t) + (1 - alpha) * y(t-1), 每个bar的计算量为O(N)
+    每列第一个非nan值作为初值, 之后遇到nan保持上一个值
+    '''
+
+    def __init__(self, alpha):
+        '''
+        :param alpha: 最新值的权重, 0到1之间
+        '''
+        self.alpha = alpha
+        self.state = None
+        self.previous = None  # 最近一次更新前的状态, 用于replace
+
+    @classmethod
+    def fromSma(cls, n, m):
+        '''
+        Sma(x,n,m)=m/n*x+(n-m)/n*Sma(x(t-1)) 按定义递归, 不截断窗口
+        '''
+        assert n >= m
+        return cls(m / n)
+
+    @classmethod
+    def fromSpan(cls, span):
+        return cls(2 / (span + 1))
+
+    @classmethod
+    def fromHalflife(cls, halflife):
+        return cls(1 - np.exp(-np.log(2) / halflife))
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        self.previous = self.state
+        if self.state is None:
+            self.state = values.copy()
+            return self
+        state = np.where(np.isnan(values), self.state, self.alpha * values + (1 - self.alpha) * self.state)
+        self.state = np.where(np.isnan(self.state), values, state)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用, 从上一个状态重新递归
+        :return: self
+        '''
+        previous = self.previous
+        self.state = previous
+        self.update(values)
+        self.previous = previous
+        return self
+
+    def value(self):
+        return self.state.copy()
+
+
+class RollingExpSum:
+    '''
+    窗口内的指数加权和 sum(decay ** k * x(t-k)), k = 0, …, num-1, 与panelCalculator.Wma一致
+    递归 S(t) = x(t) + decay * S(t-1) - decay ** num * x(t-num), 每num次更新用缓存的权值重算一次
+    窗口内有nan的列输出nan
+    '''
+
+    def __init__(self, num, decay, recompute=None):
+        '''
+        :param num: 窗口长度
+        :param decay: 每往前一期权值乘以的系数
+        :param recompute: 每更新多少次重算一次, None则取num
+        '''
+        self.num = num
+        self.decay = decay
+        self.decayNum = decay ** num
+        self.weights = decay ** np.arange(num - 1, -1, -1, dtype=np.float64)  # 按时间从早到晚排列
+        self.recompute = num if recompute is None else recompute
+        self.window = RollingWindow(num)
+        self.total = None
+        self.nans = None
+        self.updates = 0
+
+    @classmethod
+    def fromWma(cls, num, pct, weightType='exp'):
+        '''
+        :param weightType: exp时每期的系数为pct, halflife时pct为半衰期
+        '''
+        if weightType == 'exp':
+            return cls(num, pct)
+        elif weightType == 'halflife':
+            return cls(num, np.exp(-np.log(2) / pct))
+        raise NotImplementedError
+
+    def reset(self):
+        data = self.window.values()
+        self.nans = np.isnan(data).sum(axis=0)
+        self.total = np.dot(self.weights[self.num - len(data):], np.nan_to_num(data))
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        leaving = self.window.push(values)
+        self.updates += 1
+        if self.total is None or self.updates % self.recompute == 0:
+            self.reset()
+            return self
+        self.total = self.total * self.decay + np.nan_to_num(values)
+        self.nans += np.isnan(values)
+        if leaving is not None:
+            self.total -= self.decayNum * np.nan_to_num(leaving)
+            self.nans -= np.isnan(leaving)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用, 最新值的权值为1
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        old = self.window.replace(values)
+        self.total += np.nan_to_num(values) - np.nan_to_num(old)
+        self.nans += np.isnan(values).astype(np.int64) - np.isnan(old)
+        return self
+
+    def value(self):
+        '''
+        :return: 加权和, 窗口未满时输出nan(panelCalculator.Wma数据不足时抛出异常)
+        '''
+        value = self.total.copy()
+        value[self.nans > 0] = np.nan
+        if not self.window.isFull():
+            value[:] = np.nan
+        return value
+
+
+class RollingLinearDecay:
+    '''
+    窗口内线性衰减的加权平均, 权值按时间从早到晚为1, 2, …, num除以权值和, 与panelCalculator.Decaylinear一致
+    记L(t)为加权和, S(t)为窗口内的和, 则 L(t) = L(t-1) + num * x(t) - S(t-1), S(t) = S(t-1) + x(t) - x(t-num)
+    每num次更新重算一次, 窗口内有nan的列输出nan
+    '''
+
+    def __init__(self, num, recompute=None):
+        self.num = num
+        self.weights = np.arange(1, num + 1, dtype=np.float64)
+        self.weightSum = num * (num + 1) / 2
+        self.recompute = num if recompute is None else recompute
+        self.window = RollingWindow(num)
+        self.linear = None
+        self.total = None
+        self.nans = None
+        self.updates = 0
+
+    def reset(self):
+        data = self.window.values()
+        self.nans = np.isnan(data).sum(axis=0)
+        data = np.nan_to_num(data)
+        self.linear = np.dot(self.weights[self.num - len(data):], data)
+        self.total = data.sum(axis=0)
+
+    def update(self, values):
+        '''
+        :param values: 最新一行
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        leaving = self.window.push(values)
+        self.updates += 1
+        if self.linear is None or self.updates % self.recompute == 0:
+            self.reset()
+            return self
+        x = np.nan_to_num(values)
+        self.linear += self.num * x - self.total
+        self.total += x
+        self.nans += np.isnan(values)
+        if leaving is not None:
+            self.total -= np.nan_to_num(leaving)
+            self.nans -= np.isnan(leaving)
+        return self
+
+    def replace(self, values):
+        '''
+        最新一行被修改时调用, 最新值的权值为num
+        :return: self
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        old = self.window.replace(values)
+        delta = np.nan_to_num(values) - np.nan_to_num(old)
+        self.linear += self.num * delta
+        self.total += delta
+        self.nans += np.isnan(values).astype(np.int64) - np.isnan(old)
+        return self
+
+    def value(self):
+        '''
+        :return: 加权平均, 窗口未满时输出nan(panelCalculator.Decaylinear数据不足时抛出异常)
+        '''
+        value = self.linear / self.weightSum
+        value[self.nans > 0] = np.nan
+        if not self.window.isFull():
+            value[:] = np.nan
+        return value
+
+
+class RollingWeightedSum:
+    '''
+    窗口内按给定权值加权求和, 用于不能递归的权值, 如panelCalculator.Sma的有限窗口权值
+    权值只在初始化时给定一次, 每个bar只把新值写入环形缓存, 取值时按缓存的位置旋转权值后做一次点积
+    '''
+
+    def __init__(self, weights):
+        '''
+        :param weights: 按时间从早到晚排列的权值, 如panelCalculator.SmaWeights(n, m)
+        '''
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.window = RollingWindow(len(self.weights))
+
+    def update(self, values):
+        self.window.push(np.asarray(values, dtype=np.float64))
+        return self
+
+    def replace(self, values):
+        self.window.replace(np.asarray(values, dtype=np.float64))
+        return self
+
+    def value(self):
+        '''
+        :return: 加权和, 窗口未满时输出nan(panelCalculator.WeightedSum数据不足时抛出异常)
+        '''
+        window = self.window
+        if not window.isFull():
+            return np.full(window.buffer.shape[1], np.nan)
+        return np.dot(np.roll(self.weights, window.pos), window.buffer)  # 缓存中第pos行为最早的值
@@ -100,12 +100,19 @@ class FactorUpdate:
                 factorObjectDict = {}
                 rawFactorDict = {}
                 factorTesterDict = {}
+                factorSinkDict = {}
 
                 for freq in self.testFreq:
                     reasampleFeedDict[freq] = ResampledPanelFeed(panelFeed, freq)
                     _return_Dict[freq] = returns.Returns(reasampleFeedDict[freq], lag=F, maxLen=1024)
                     factorObjectDict[freq] = getattr(module, 'Factor')
                     rawFactorDict[freq] = factorBase.FactorPanel(reasampleFeedDict[freq], factorObjectDict[freq])
+                    # 因子值在运行期间分块写入文件，不受FactorPanel的maxLen限制
+                    sinkPath = pathSelector.PathSelector.getFactorFilePath(
+                        factorName=factor,
+                        factorFrequency=const.DataFrequency.freq2lable(freq),
+                        fileName=factor + "_factor_" + const.DataFrequency.freq2lable(freq) + ".tmp")
+                    factorSinkDict[freq] = h5Writer.H5PanelSink(rawFactorDict[freq], sinkPath, key=factor)
                     factorTesterDict[freq] = DefaultFactorTest(reasampleFeedDict[freq], rawFactorDict[freq], _return_Dict[freq],
                                                           indicators=['IC', 'rankIC', 'beta', 'gpIC', 'tbdf', 'turn',
                                                                       'groupRet'],
@@ -115,10 +122,14 @@ class FactorUpdate:
                 if len(_return_Dict[self.testFreq[0]]) <= 2 * F:  # 若数据长度不符合因子检验标准，则不存储
                     self.logger.warning(
                         "The length of the return panel <= 2 * the required lag. Data will not be saved.")
+                    for sink in factorSinkDict.values():
+                        sink.close()
+                        if os.path.exists(sink.getDir()):
+                            os.remove(sink.getDir())
                     return
 
                 for freq in self.testFreq:
-                    h5PanelWriter = h5Writer.H5PanelWriter(factorTesterDict[freq], factor)
+                    h5PanelWriter = h5Writer.H5PanelWriter(factorTesterDict[freq], factor, factorSink=factorSinkDict[freq])
                     h5PanelWriter.write(mode="new")
 
     def updateFactor(self, factor, removeOld=True, F=1):
@@ -148,22 +159,22 @@ class FactorUpdate:
         returnDict = {}
         rawFactorDict = {}
         factorTesterDict = {}
-        dictOldResultDict = {}
+        factorSinkDict = {}
         dictFilePathDict = {}
         for resample in self.testFreq:
-            frequencyStr = const.DataFrequency.freq2lable(resample)
-            resampleReader = h5Reader.H5BatchPanelReader(factorName=factor,
-                                                         frequency=frequencyStr)  # 读取文件夹内所有文件
-            resampleReader.prepareOutputData()  # 存入相应的字典中
-            oldResultDict = resampleReader.getTestResult()  # 获取存放dataframe数据的字典
             filePathDict = factorReader.getFilePath()  # 获取原来H5文件的路径
 
             key = str(resample).split(".")[-1]
-            dictOldResultDict[key] = oldResultDict
             dictFilePathDict[key] = filePathDict
             resampleFeedDict[key] = ResampledPanelFeed(panelFeed, resample)
             returnDict[key] = returns.Returns(resampleFeedDict[key], lag=F, maxLen=1024)
             rawFactorDict[key] = factorBase.FactorPanel(resampleFeedDict[key], factorObject)
+            # 与writeNewFactor相同, 因子值在运行期间分块写入临时文件, 不受FactorPanel的maxLen限制
+            sinkPath = pathSelector.PathSelector.getFactorFilePath(
+                factorName=factor,
+                factorFrequency=const.DataFrequency.freq2lable(resample),
+                fileName=factor + "_factor_" + const.DataFrequency.freq2lable(resample) + ".tmp")
+            factorSinkDict[key] = h5Writer.H5PanelSink(rawFactorDict[key], sinkPath, key=factor)
             factorTesterDict[key] = DefaultFactorTest(panelFeed=resampleFeedDict[key],
                                                  factorPanel=rawFactorDict[key],
                                                  returnPanel=returnDict[key],
@@ -178,9 +189,9 @@ class FactorUpdate:
         #                                  lag=F,
         #                                  cut=0.1)
         panelFeed.run(2000)
-        for key, oldResultDict in dictOldResultDict.items():
-            h5PanelWriter = h5Writer.H5PanelWriter(factorTesterDict[key], factor)
-            h5PanelWriter.write(mode="append", oldResultDict=oldResultDict)        # 使用append模式写入
+        for key, factorTester in factorTesterDict.items():
+            h5PanelWriter = h5Writer.H5PanelWriter(factorTester, factor, factorSink=factorSinkDict[key])
+            h5PanelWriter.write(mode="append")        # 使用append模式写入, 只追加已存储截止时间之后的数据
 
         # for resample in self.testFreq:
         #     frequencyStr = const.DataFrequency.freq2lable(resample)
@@ -13,6 +13,7 @@ Bar = namedtuple('Bar', 'dateTime open high low close volume')
 
 class Field:
     OHLCV = ['open', 'high', 'low', 'close', 'volume']
+    PRICE = ['open', 'high', 'low', 'close']
 
 
 class BarFeed:
@@ -139,13 +140,18 @@ class PanelFeed:
         self.stopped = False
         self.setUseEventDateTimeInLogs(True)
 
+        # 所有字段存放在同一个 时间 × field × instrument 数据块中, 各字段panel为其零拷贝视图
+        # 价格字段使用float32, 成交量、成交额等其余字段保持float64以免丢失精度
+        dtypes = {field: np.float32 if field in Field.PRICE else np.float64 for field in self.fields}
+        self.panelBlock = series.SequenceDataBlock(self.fields, instruments, self.maxLen, dtype=dtypes)
+
         if 'open' in self.fields:
             assert instruments == sorted(instruments), 'OHLCV columns must be sorted!'
-            self.openPanel = series.SequenceDataPanel(instruments, self.maxLen, dtype=np.float32)  # 定义了一个类
-            self.highPanel = series.SequenceDataPanel(instruments, self.maxLen, dtype=np.float32)
-            self.lowPanel = series.SequenceDataPanel(instruments, self.maxLen, dtype=np.float32)
-            self.closePanel = series.SequenceDataPanel(instruments, self.maxLen, dtype=np.float32)
-            self.volumePanel = series.SequenceDataPanel(instruments, self.maxLen)
+            self.openPanel = self.panelBlock.getPanel('open')
+            self.highPanel = self.panelBlock.getPanel('high')
+            self.lowPanel = self.panelBlock.getPanel('low')
+            self.closePanel = self.panelBlock.getPanel('close')
+            self.volumePanel = self.panelBlock.getPanel('volume')
 
             self.barFeeds = {}
             for instrument in instruments:
@@ -160,11 +166,10 @@ class PanelFeed:
                                                     frequency=self.frequency,
                                                     maxLen=self.maxLen)
 
-        self.fields = list(self.dataSource.fields)
         self.extraPanel = {}
         for field in self.fields:
             if field not in Field.OHLCV:
-                self.extraPanel[field] = series.SequenceDataPanel(instruments, maxLen, dtype=np.float32)
+                self.extraPanel[field] = self.panelBlock.getPanel(field)
 
         self.__panelEvents = collections.OrderedDict({e: observer.Event() for e in self.EventPriority.getEventsType()})
 
@@ -218,22 +223,22 @@ class PanelFeed:
         for key, evt in self.__panelEvents.items():
             evt.emit(*args, **kwargs)
 
+    def getPanelBlock(self):
+        return self.panelBlock
+
     def appendNextValues(self, dateTime, df):
         '''
         更新内部数值
+        :param df: 行为code列为field的DataFrame, 或已经对齐好的 field × instrument 数组(行按fields, 列按instruments顺序),
+                   数组直接整块拷贝进panelBlock
         '''
+        if isinstance(df, np.ndarray):
+            self.panelBlock.appendWithDateTime(dateTime, df)
+            return
 
         assert set(self.instruments) == set(df.index.values), '成分股发生变化！'
 
-        if 'close' in self.dataSource.fields:
-            self.openPanel.appendWithDateTime(dateTime, df['open'].sort_index().values)
-            self.highPanel.appendWithDateTime(dateTime, df['high'].sort_index().values)
-            self.lowPanel.appendWithDateTime(dateTime, df['low'].sort_index().values)
-            self.closePanel.appendWithDateTime(dateTime, df['close'].sort_index().values)
-            self.volumePanel.appendWithDateTime(dateTime, df['volume'].sort_index().values)
-
-        for extraField in self.extraPanel:
-            self.extraPanel[extraField].appendWithDateTime(dateTime, df[extraField].sort_index().values)
+        self.panelBlock.appendWithDateTime(dateTime, df.sort_index()[self.fields].values.T)
 
     def getNextValues(self):
 
@@ -478,7 +483,7 @@ class AdvancedFeed:
                     self.feedDict[lable].appendNextValues(dateTime, value)
                     self.feedDict[lable].dispatchNewValueEvent(self, dateTime, value)
                 else:
-                    self.panelDict[lable].appendWithDateTime(dateTime, value.values)
+                    self.panelDict[lable].appendWithDateTime(dateTime, np.asarray(value))
 
         self.available = available
         self.allAvailable = available.copy()
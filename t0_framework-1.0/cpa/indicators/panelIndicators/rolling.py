@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from cpa.utils.series import SequenceDataPanel
+from cpa.calculator import panelCalculator
+from cpa.calculator.rollingCalculator import RollingMoments, RollingExtremum, RollingQuantile
+from cpa.calculator.rollingCalculator import ExponentialFilter, RollingExpSum, RollingLinearDecay, RollingWeightedSum
+
+
+class RollingMoment(SequenceDataPanel):
+    '''
+    滚动窗口统计量, 每个bar只用进入和离开窗口的值增量更新, 计算量与窗口长度无关
+    - 不可对panel赋值,若赋值须copy一份
+    '''
+    ORDERS = {'mean': 1, 'sum': 1, 'var': 2, 'std': 2, 'skew': 3, 'kurt': 4}
+
+    def __init__(self, dataPanel, n, stat='mean', maxLen=None, skipna=False, minobs=0, ddof=0):
+        '''
+        :param dataPanel: 输入的panel
+        :param n: 窗口长度
+        :param stat: 统计量, mean/sum/var/std/skew/kurt
+        :param skipna: 是否跳过nan, False时窗口内有nan的列输出nan
+        :param minobs: skipna=True时最少的有效值个数
+        :param ddof: var和std的自由度, 0为有效估计
+        '''
+        super().__init__(dataPanel.getColumnNames(), maxLen=maxLen)
+        dataPanel.getNewValuesEvent().subscribe(self.onNewValues)
+        dataPanel.getUpdateValuesEvent().subscribe(self.onUpdateValues)
+        self.stat = stat
+        self.ddof = ddof
+        self.calculator = RollingMoments(n, order=self.ORDERS[stat], skipna=skipna, minobs=minobs)
+
+    def getValue(self):
+        if self.stat in ('var', 'std'):
+            return getattr(self.calculator, self.stat)(self.ddof)
+        return getattr(self.calculator, self.stat)()
+
+    def onNewValues(self, dataPanel, dateTime, values):
+        '''
+        :return:最新的一行值
+        '''
+        self.calculator.update(values)
+        self.appendWithDateTime(dateTime, self.getValue())
+
+    def onUpdateValues(self, dataPanel, dateTime, values):
+        self.calculator.replace(values)
+        self.updateWithDateTime(dateTime, self.getValue())
+
+
+class RollingExtreme(SequenceDataPanel):
+    '''
+    滚动窗口的最大(小)值或其距当前的间隔数, 使用单调队列增量更新
+    - 不可对panel赋值,若赋值须copy一份
+    '''
+    STATS = {'max': (True, 'value'), 'min': (False, 'value'),
+             'tsToMax': (True, 'position'), 'tsToMin': (False, 'position')}
+
+    def __init__(self, dataPanel, n, stat='max', maxLen=None):
+        '''
+        :param dataPanel: 输入的panel
+        :param n: 窗口长度
+        :param stat: max/min/tsToMax/tsToMin, 与panelCalculator中的Max/Min/TsToMax/TsToMin对应, nan不参与比较
+        '''
+        super().__init__(dataPanel.getColumnNames(), maxLen=maxLen)
+        dataPanel.getNewValuesEvent().subscribe(self.onNewValues)
+        dataPanel.getUpdateValuesEvent().subscribe(self.onUpdateValues)
+        isMax, self.output = self.STATS[stat]
+        self.calculator = RollingExtremum(n, isMax=isMax)
+
+    def getValue(self):
+        return getattr(self.calculator, self.output)()
+
+    def onNewValues(self, dataPanel, dateTime, values):
+        self.calculator.update(values)
+        self.appendWithDateTime(dateTime, self.getValue())
+
+    def onUpdateValues(self, dataPanel, dateTime, values):
+        self.calculator.replace(values)
+        self.updateWithDateTime(dateTime, self.getValue())
+
+
+class MovingQuantile(SequenceDataPanel):
+    '''
+    滚动窗口的分位数, 每列维护窗口内的有序数组增量更新
+    - 不可对panel赋值,若赋值须copy一份
+    '''
+
+    def __init__(self, dataPanel, n, q=0.5, maxLen=None, skipna=False, minobs=0):
+        '''
+        :param dataPanel: 输入的panel
+        :param n: 窗口长度
+        :param q: 分位点，0到1之间，0.5为中位数
+        :param skipna: 是否跳过nan, False时窗口内有nan的列输出nan
+        :param minobs: 非nan值少于minobs的列输出nan
+        '''
+        super().__init__(dataPanel.getColumnNames(), maxLen=maxLen)
+        dataPanel.getNewValuesEvent().subscribe(self.onNewValues)
+        dataPanel.getUpdateValuesEvent().subscribe(self.onUpdateValues)
+        self.q = q
+        self.calculator = RollingQuantile(n, skipna=skipna, minobs=minobs)
+
+    def onNewValues(self, dataPanel, dateTime, values):
+        self.calculator.update(values)
+        self.appendWithDateTime(dateTime, self.calculator.quantile(self.q))
+
+    def onUpdateValues(self, dataPanel, dateTime, values):
+        self.calculator.replace(values)
+        self.updateWithDateTime(dateTime, self.calculator.quantile(self.q))
+
+
+class DecayFilter(SequenceDataPanel):
+    '''
+    指数、线性衰减等加权平均, 能递归的按bar递归更新, 不能递归的权值只计算一次
+    - 不可对panel赋值,若赋值须copy一份
+    '''
+
+    def __init__(self, dataPanel, n, kind='ema', m=1, pct=None, weightType='exp', maxLen=None):
+        '''
+        :param dataPanel: 输入的panel
+        :param n: 窗口长度
+        :param kind: ema为按Sma定义递归的指数平均, alpha = m / n, 不截断窗口;
+                     sma/wma/decaylinear分别与panelCalculator中的Sma/Wma/Decaylinear一致
+        :param m: ema和sma的权值
+        :param pct: wma的衰减系数或半衰期
+        :param weightType: wma的权重方式, exp或halflife
+        '''
+        super().__init__(dataPanel.getColumnNames(), maxLen=maxLen)
+        dataPanel.getNewValuesEvent().subscribe(self.onNewValues)
+        dataPanel.getUpdateValuesEvent().subscribe(self.onUpdateValues)
+        if kind == 'ema':
+            self.calculator = ExponentialFilter.fromSma(n, m)
+        elif kind == 'sma':
+            self.calculator = RollingWeightedSum(panelCalculator.SmaWeights(n, m))
+        elif kind == 'wma':
+            self.calculator = RollingExpSum.fromWma(n, pct, weightType)
+        elif kind == 'decaylinear':
+            self.calculator = RollingLinearDecay(n)
+        else:
+            raise NotImplementedError
+
+    def onNewValues(self, dataPanel, dateTime, values):
+        self.calculator.update(values)
+        self.appendWithDateTime(dateTime, self.calculator.value())
+
+    def onUpdateValues(self, dataPanel, dateTime, values):
+        self.calculator.replace(values)
+        self.updateWithDateTime(dateTime, self.calculator.value())
+
+
+if __name__ == '__main__':
+    from cpa.feed.feedFactory import InlineDataSet
+
+    panelFeed = InlineDataSet.HS300_MINUTE()
+    stdPanel = RollingMoment(panelFeed.closePanel, n=240, stat='std', maxLen=1024)
+
+    panelFeed.run(500)
+
+    # 数据展示
+    print(stdPanel.to_frame())
@@ -5,6 +5,7 @@
 @Email   : sdu.xuefu@gmail.com
 '''
 import abc
+import numpy as np
 import pandas as pd
 
 class IndexInstruments:
@@ -123,6 +124,7 @@ class BasePanelReader(BaseReader):
     def __init__(self, isInstrumentCol=True):
         self.isInstrumentCol = isInstrumentCol
         self.df = None #加载好的数据表格
+        self.arrays = None #df对应的(datetime64索引, ndarray数值)缓存
 
     def from_dataframe(self, df):
         '''
@@ -132,6 +134,33 @@ class BasePanelReader(BaseReader):
         self.df = df
         return self
 
+    def getArrays(self):
+        '''
+        :return: (dateTimes, values), dateTimes为datetime64[ns]数组, values为df的ndarray,
+                 df为series时values为一维数组, 按df缓存, df替换后重新生成
+        '''
+        if self.arrays is None or self.arrays[0] is not self.df:
+            dateTimes = np.asarray(pd.DatetimeIndex(self.df.index).values, dtype='datetime64[ns]')
+            self.arrays = (self.df, dateTimes, self.df.values)
+        return self.arrays[1], self.arrays[2]
+
+    def iterRows(self):
+        '''
+        :return: 逐行输出(Timestamp, ndarray行)的迭代器, 不再为每行构造Series
+        '''
+        dateTimes, values = self.getArrays()
+        for idx in range(len(dateTimes)):
+            yield pd.Timestamp(dateTimes[idx]), values[idx]
+
+    def iterChunks(self, chunkSize):
+        '''
+        :param chunkSize: 每块的行数
+        :return: 逐块输出(datetime64数组, ndarray)的迭代器, 输出为视图, 不复制数据
+        '''
+        dateTimes, values = self.getArrays()
+        for start in range(0, len(dateTimes), chunkSize):
+            yield dateTimes[start:start + chunkSize], values[start:start + chunkSize]
+
     @abc.abstractmethod
     def to_static_panel(self):
         '''
@@ -9,10 +9,10 @@
 '''
 
 import os
-import datetime
 import pandas as pd
 import numpy as np
 from cpa.io import BaseDataReader
+from cpa.io.csvReader import deferDuplicateDates, FinanceChangeLog
 from cpa.utils import logger
 from cpa.utils import bar
 from cpa.feed import baseFeed
@@ -60,35 +60,28 @@ class FinanceReader(BaseDataReader):
         '''
         self.df = pd.read_csv(self.filePath)
         self.df = self.df[pd.notnull(self.df["ANN_DT"])]  # 删除公告日期为NAN的行
-        self.df["ANN_DT"] = pd.to_datetime(self.df["ANN_DT"], format="%Y%m%d")
-        self.df["ANN_DT"] = self.df["ANN_DT"].dt.date
+        self.df["ANN_DT"] = pd.to_datetime(self.df["ANN_DT"].astype(np.int64).astype(str), format="%Y%m%d")
 
         if self.start:  # 取开始时间之后的数据
-            self.df = self.df[self.df["ANN_DT"] > pd.Timestamp(self.start).date()]
+            self.df = self.df[self.df["ANN_DT"] > pd.Timestamp(self.start).normalize()]
         if self.end:  # 取结束时间之前的数据
-            self.df = self.df[self.df["ANN_DT"] < pd.Timestamp(self.end).date()]
+            self.df = self.df[self.df["ANN_DT"] < pd.Timestamp(self.end).normalize()]
         self.df[["WIND_CODE", "temp"]] = self.df["WIND_CODE"].str.split(".", expand=True)  # 删除股票代码后缀，保留数字
         self.df.drop(columns="temp", inplace=True)
         self.availInstruments = sorted(set(self.df["WIND_CODE"]) & set(self.instruments))  # 取股票代码交集，并排序
         self.df = self.df[self.df["WIND_CODE"].isin(self.availInstruments)]  # 删除不在股票代码集合中的行
 
         # 当出现同一公告日同一股票多条数据的情况时，将公告日递延一天
-        self.df.sort_values(by=["WIND_CODE", "ANN_DT"], inplace=True)
-        self.df.reset_index(inplace=True)
-        boolDF = self.df[["WIND_CODE", "ANN_DT"]].eq(self.df[["WIND_CODE", "ANN_DT"]].shift(1)).all(axis="columns")
-        duplicatedRowIndex = boolDF.index[boolDF == True].tolist()
-        for idx in duplicatedRowIndex:
-            datePlusOne = self.df.iloc[idx - 1]["ANN_DT"] + datetime.timedelta(days=1)
-            self.df.loc[idx, "ANN_DT"] = datePlusOne
-            if idx <= len(self.df) - 2:
-                if self.df.loc[idx]["ANN_DT"] == self.df.loc[idx + 1]["ANN_DT"]:
-                    self.df.loc[idx + 1, "ANN_DT"] = self.df.iloc[idx]["ANN_DT"] + datetime.timedelta(days=1)
+        self.df = self.df.sort_values(by=["WIND_CODE", "ANN_DT"], kind="mergesort")
+        self.df["ANN_DT"] = deferDuplicateDates(self.df["WIND_CODE"].values, self.df["ANN_DT"].values)
 
         self.df.set_index(["ANN_DT", "WIND_CODE"], inplace=True)  # 设置双index，并排序
         self.df.sort_index(axis=0, inplace=True)
         self.df = self.df[self.fields]  # 取所需字段的数据，删除其他列
 
-        self.allDate = [date for date in np.unique(self.df.index.get_level_values(level="ANN_DT"))]  # 生成一个含所有日期的列表
+        # 公告日 × field × instrument 的变更记录, 可按时间点对齐到分钟或日频时间轴
+        self.changeLog = FinanceChangeLog.from_frame(self.df, self.availInstruments, self.fields)
+        self.allDate = [pd.Timestamp(date) for date in self.changeLog.getDates()]  # 生成一个含所有日期的列表
         self.valGen = self.valueGenerator()  # 生成generator并赋值
 
         return self.df
@@ -96,17 +89,12 @@ class FinanceReader(BaseDataReader):
     def valueGenerator(self):
         '''
         生成器
-        return: 从df中读取下一个时间的数据，返回时间和一个dataframe，行是股票代码，列是所选字段
+        return: 从变更记录中读取下一个公告日的数据，返回时间和一个 field × instrument 数组，
+                列与availInstruments对齐，当日未公告的股票为nan
         '''
+        block = self.changeLog.getBlock()
         for idx, date in enumerate(self.allDate):
-            tempDF = self.df.loc[date]
-            # tempDF = tempDF[~tempDF.index.duplicated(keep="first")]  # 使用递延处理，这里注释掉只保留一行的处理
-            # 生成一个列表，列表包含存在于股票交集而不在tempDF中的股票
-            emptyInsList = [ins for ins in self.availInstruments if ins not in tempDF.index.values]
-            emptyDF = pd.DataFrame(columns=self.fields, index=emptyInsList)  # 生成一个只包含行名和列名的空dataframe
-            tempDF = tempDF.append(emptyDF)
-            tempDF.sort_index(inplace=True)
-            yield date, tempDF
+            yield date, block[idx]
 
             if idx == len(self.allDate) - 2:
                 self.isEof = True
@@ -118,6 +106,13 @@ class FinanceReader(BaseDataReader):
         '''
         return self.filePath
 
+    def getChangeLog(self):
+        '''
+        返回变更记录
+        return: FinanceChangeLog, 可通过asof/to_static_panels对齐到PanelFeed的时间轴
+        '''
+        return self.changeLog
+
     def getFrequency(self):
         '''
         返回数据周期
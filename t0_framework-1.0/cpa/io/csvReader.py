@@ -3,7 +3,8 @@
 '''
 
 import os
-import datetime
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from cpa.utils import logger
@@ -15,31 +16,165 @@ from cpa.utils import series
 
 
 
-def read_csv_with_filter(path, instrument, startTime=None):
+CSV_DTYPES = {
+    'day': str,
+    'time': str,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64,
+    'turnover': np.float64}
+
+
+def read_csv_file(path, instrument):
     '''
-    读取csv数据并转换为DataFrame,包括open,high,low,close,volume,turnover,date,code
+    读取csv数据并转换为DataFrame,包括code,date,open,high,low,close,volume
     :param path: 路径
     :param instrument:代码
-    :param startTime: 起始时间
     :return: df, 读取csv文件
     '''
     fileName = '{}.csv'.format(instrument)
     filePath = os.path.join(path, fileName)
-    df = pd.read_csv(filePath, header=None)
-    df.columns = [
-        'day',
-        'time',
-        'open',
-        'high',
-        'low',
-        'close',
-        'volume',
-        'turnover']
+    df = pd.read_csv(filePath, header=None, names=list(CSV_DTYPES.keys()), dtype=CSV_DTYPES)
     df['date'] = pd.to_datetime(df['day'] + ' ' + df['time'])
     df['code'] = instrument
+    return df[['code', 'date', 'open', 'high', 'low', 'close', 'volume']]
+
+
+def read_csv_cached(path, instrument, cacheDir=None):
+    '''
+    读取csv数据, 解析结果以pickle形式缓存在cacheDir中, 按文件路径和修改时间判断缓存是否有效
+    :param path: 路径
+    :param instrument:代码
+    :param cacheDir: 缓存文件夹, None则不使用缓存
+    :return: df, 与read_csv_file相同
+    '''
+    if cacheDir is None:
+        return read_csv_file(path, instrument)
+    filePath = os.path.join(path, '{}.csv'.format(instrument))
+    cachePath = os.path.join(cacheDir, '{}.pickle'.format(instrument))
+    mtime = os.path.getmtime(filePath)
+    if os.path.exists(cachePath):
+        try:
+            with open(cachePath, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['path'] == filePath and cached['mtime'] == mtime:
+                return cached['data']
+        except Exception:
+            pass  # 缓存损坏时重新读取csv
+    df = read_csv_file(path, instrument)
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        tmpPath = cachePath + '.{}.tmp'.format(os.getpid())
+        with open(tmpPath, 'wb') as f:
+            pickle.dump({'path': filePath, 'mtime': mtime, 'data': df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, cachePath)
+    except OSError:
+        pass  # 没有写权限时只是不缓存
+    return df
+
+
+def read_csv_with_filter(path, instrument, startTime=None, cacheDir=None):
+    '''
+    读取csv数据并转换为DataFrame,包括open,high,low,close,volume,turnover,date,code
+    :param path: 路径
+    :param instrument:代码
+    :param startTime: 起始时间
+    :param cacheDir: 缓存文件夹, None则不使用缓存
+    :return: df, 读取csv文件
+    '''
+    df = read_csv_cached(path, instrument, cacheDir)
     if startTime is not None:
         df = df[df['date'] > startTime]
-    return df[['code', 'date', 'open', 'high', 'low', 'close', 'volume']]
+    return df
+
+
+def deferDuplicateDates(codes, dates):
+    '''
+    当出现同一公告日同一股票多条数据的情况时，将公告日依次递延一天，保证每只股票的公告日严格递增
+    :param codes: 股票代码, 需已按代码、公告日排序
+    :param dates: 公告日
+    :return: 递延后的公告日, datetime64[ns]数组
+    '''
+    codes = np.asarray(codes)
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    rank = pd.Series(codes).groupby(codes).cumcount().values  # 每只股票内部的序号
+    # 递延后第i条不早于第i-1条加一天, 等价于 days - rank 在每只股票内取累计最大值后再加回 rank
+    deferred = pd.Series(days - rank).groupby(codes).cummax().values + rank
+    return deferred.astype('datetime64[D]').astype('datetime64[ns]')
+
+
+class FinanceChangeLog:
+    '''
+    财务数据的变更记录: 只在公告日记录发生变化的 股票 × 字段,
+    通过searchsorted一次性按时间点对齐(as-of)到任意分钟或日频时间轴上, 并向前填充
+    '''
+
+    def __init__(self, dateTimes, codes, values, instruments, fields):
+        '''
+        :param dateTimes: 每条记录的公告日
+        :param codes: 每条记录的股票代码
+        :param values: 记录 × fields 的数值
+        :param instruments: 股票代码列表, 决定输出的列顺序
+        :param fields: 字段列表
+        '''
+        dateTimes = np.asarray(pd.DatetimeIndex(dateTimes).values, dtype='datetime64[ns]')
+        order = np.argsort(dateTimes, kind='mergesort')
+        self.instruments = list(instruments)
+        self.fields = list(fields)
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.dates, dateIdx = np.unique(dateTimes[order], return_inverse=True)
+        codeIdx = pd.Index(self.instruments).get_indexer(np.asarray(codes)[order])
+        assert (codeIdx >= 0).all(), '变更记录中包含未注册的股票'
+
+        # 公告日 × field × instrument 的变更数组, 当日未公告的股票为nan
+        self.block = np.full((len(self.dates), len(self.fields), len(self.instruments)), np.nan)
+        self.block[dateIdx, :, codeIdx] = self.values
+        # 公告日 × instrument, 截至该公告日每只股票最新一条记录的行号, 尚无记录为-1
+        lastRow = np.full((len(self.dates), len(self.instruments)), -1, dtype=np.int64)
+        lastRow[dateIdx, codeIdx] = np.arange(len(self.values))
+        self.lastRow = np.maximum.accumulate(lastRow, axis=0)
+
+    @classmethod
+    def from_frame(cls, df, instruments, fields):
+        '''
+        :param df: 索引为(公告日, 股票代码)的dataframe
+        '''
+        return cls(df.index.get_level_values(0), df.index.get_level_values(1), df[fields].values, instruments, fields)
+
+    def getDates(self):
+        return self.dates
+
+    def getBlock(self):
+        '''
+        :return: 公告日 × field × instrument 的变更数组
+        '''
+        return self.block
+
+    def asof(self, dateTimes, delay=pd.Timedelta(hours=15), dtype=np.float32):
+        '''
+        :param dateTimes: 目标时间轴, 如PanelFeed的分钟或日频时间
+        :param delay: 公告日之后多久可用, 默认与AdvancedFeed一致为当日15:00
+        :return: 时间 × field × instrument 数组, 每个时间点为此前已公告的最新值, 尚无公告为nan
+        '''
+        dateTimes = np.asarray(pd.DatetimeIndex(dateTimes).values, dtype='datetime64[ns]')
+        available = self.dates + pd.Timedelta(delay).to_timedelta64()
+        pos = np.searchsorted(available, dateTimes, side='right') - 1
+        rows = self.lastRow[np.maximum(pos, 0)]
+        rows[pos < 0] = -1
+        ret = self.values.astype(dtype)[rows].transpose(0, 2, 1)  # 时间 × instrument × field 转置为 时间 × field × instrument
+        ret[np.broadcast_to((rows < 0)[:, None, :], ret.shape)] = np.nan
+        return ret
+
+    def to_static_panels(self, dateTimes, maxLen=None, delay=pd.Timedelta(hours=15), dtype=np.float32):
+        '''
+        :return: {field: SequenceDataPanel}, 对齐到dateTimes后的静态panel, 可与分钟因子一起计算
+        '''
+        values = self.asof(dateTimes, delay=delay, dtype=dtype)
+        return {field: series.SequenceDataPanel.from_array(values[:, i, :], dateTimes, self.instruments,
+                                                         maxLen=maxLen, dtype=dtype)
+                for i, field in enumerate(self.fields)}
 
 
 class CSVSampleDataReader(BaseDataReader):
@@ -50,7 +185,13 @@ class CSVSampleDataReader(BaseDataReader):
 
     logger = logger.getLogger("csvReader")
 
-    def __init__(self, frequency=bar.Frequency.MINUTE, instruments=None, start=None):
+    CACHE_DIR = '.cache'
+
+    def __init__(self, frequency=bar.Frequency.MINUTE, instruments=None, start=None, workers=1, useCache=True):
+        '''
+        :param workers: 并行读取csv的进程数, 默认1在当前进程中顺序读取, 大于1或None(cpu核数)时使用进程池
+        :param useCache: 是否将解析后的数据缓存在数据路径下的.cache文件夹中
+        '''
         super().__init__(instruments, fields=const.DataField.OHLCV, start=start)
 
         self.frequency = frequency
@@ -58,6 +199,8 @@ class CSVSampleDataReader(BaseDataReader):
         self.dfs = []
         self.isEof = False
         self.valGen = None
+        self.workers = workers
+        self.useCache = useCache
         self.path = pathSelector.PathSelector.getDataFilePath(market=const.DataMarket.STOCK, types=const.DataType.SAMPLE, frequency=const.DataFrequency.MINUTE)
 
     def _iter_(self):
@@ -96,28 +239,46 @@ class CSVSampleDataReader(BaseDataReader):
         self.instruments = list(set(self.instruments) & set(fileLists))  # 求交集
         self.instruments.sort()
         self.logger.info("The stock list: {}".format(self.instruments))
-        self.codeFrame = pd.DataFrame({'code': self.instruments})
 
-        for instrument in self.instruments:
-            self.logger.info('Loading Data {}'.format(instrument))
-            thisData = read_csv_with_filter(self.path, instrument, self.start)
-            self.dfs.append(thisData)
+        cacheDir = os.path.join(self.path, self.CACHE_DIR) if self.useCache else None
+        if self.workers == 1 or len(self.instruments) <= 1:
+            for instrument in self.instruments:
+                self.logger.info('Loading Data {}'.format(instrument))
+                self.dfs.append(read_csv_with_filter(self.path, instrument, self.start, cacheDir))
+        else:
+            self.logger.info('Loading Data {} files'.format(len(self.instruments)))
+            n = len(self.instruments)
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                self.dfs = list(executor.map(read_csv_with_filter, [self.path] * n, self.instruments,
+                                             [self.start] * n, [cacheDir] * n))
         self.dfs = pd.concat(self.dfs, axis=0)
         self.dfs.sort_values(['date', 'code'], ascending=True, inplace=True)
         self.allTime = np.unique(self.dfs['date'])
+        self.values = self.pivot(self.dfs)
 
         self.valGen = self.valueGenerator()
 
+    def pivot(self, dfs):
+        '''
+        将长表一次性转换为 时间 × field × instrument 的数组, 时间与allTime对齐, instrument与instruments对齐, 缺失为nan
+        :param dfs: 包含code,date和fields各列的dataframe
+        :return: np.ndarray
+        '''
+        values = np.full((len(self.allTime), len(self.fields), len(self.instruments)), np.nan)
+        timeIdx = np.searchsorted(self.allTime, dfs['date'].values)
+        codeIdx = np.searchsorted(np.asarray(self.instruments), dfs['code'].values)
+        for i, field in enumerate(self.fields):
+            values[timeIdx, i, codeIdx] = dfs[field].values
+        return values
+
     def valueGenerator(self):
         '''
-        :return:从dfs中读取下一个时间的数据,返回时间和一个dataframe：行为code,列为高开低收量，{下一时刻时间:对应股票数据dataframe}
+        :return:从values中读取下一个时间的数据,返回时间和一个 field × instrument 数组,
+                行与fields对齐, 列与instruments对齐, 可直接写入PanelFeed
         '''
+        values = self.values
         for idx, _date in enumerate(self.allTime):
-            ret = self.dfs[self.dfs['date'] == _date]
-            ret = pd.merge(ret, self.codeFrame, on='code', how='outer')
-            ret = ret.set_index('code')
-            del ret['date']
-            yield pd.to_datetime(_date), ret
+            yield pd.Timestamp(_date), values[idx]
 
             if idx == len(self.allTime) - 2:
                 self.isEof = True
@@ -218,11 +379,9 @@ class CSVPanelReader(BasePanelReader):
 
     def getIterator(self):
         '''
-        返回一个pandas迭代器
+        返回一个逐行输出(Timestamp, ndarray)的迭代器, dataframe输出一行数组, series输出标量
         '''
-        # 判断所读取的数据为dataframe还是series，相应地生成迭代器
-        self.iterator = self.df.iterrows() if len(
-            self.df.shape) == 2 else self.df.iteritems()
+        self.iterator = self.iterRows()
         return self.iterator
 
     def getDir(self):
@@ -283,14 +442,12 @@ class CSVPanelReader(BasePanelReader):
         直接将全量数据转换为静态的SequenceDataPanel，返回对象
         '''
         if len(self.df.shape) == 2:
-            self.staticPanel = series.SequenceDataPanel(
-                self.getRegisteredInstruments(), maxLen=maxLen, dtype=np.float32)
-            for index, row in self.df.iterrows():
-                self.staticPanel.appendWithDateTime(index, row)
+            self.staticPanel = series.SequenceDataPanel.from_array(
+                self.df.values, self.df.index, self.getRegisteredInstruments(), maxLen=maxLen, dtype=np.float32)
             return self.staticPanel
         else:
             self.staticSeries = series.SequenceDataSeries(maxLen=maxLen)
-            for index, row in self.df.iteritems():
+            for index, row in self.df.items():
                 self.staticSeries.appendWithDateTime(index, row)
             return self.staticSeries
 
@@ -411,10 +568,8 @@ class CSVFutureDataReader(BaseDataReader):
             df = self.readCSVFile(self.allFutures[future])
             if len(df) > 0:
                 self.futureDict[future] = df
-                tmpIndex = list(df.index)
-                self.firstDict[future] = tmpIndex[0]
-                wholeIndex = wholeIndex + tmpIndex
-                del tmpIndex
+                self.firstDict[future] = df.index[0]
+                wholeIndex.append(df.index.values)
                 self.logger.info('{} data get'.format(future))
             else:
                 # 若某品种的第一个交易时间晚于end，把它移出registeredInstruments
@@ -424,7 +579,7 @@ class CSVFutureDataReader(BaseDataReader):
             self.registeredInstruments.remove(j)
 
         # 初始化self.wholeIndex，是一个列表，储存start和end之间所有的交易时间
-        self.wholeIndex = np.unique(wholeIndex)
+        self.wholeIndex = np.unique(np.concatenate(wholeIndex)) if len(wholeIndex) > 0 else np.array([], dtype='datetime64[ns]')
         del wholeIndex
         if len(self.wholeIndex) == 0:  # 若start和end之间一个品种的数据都没有，把终止信号设为TRUE
             self.isEof = True
@@ -447,6 +602,22 @@ class CSVFutureDataReader(BaseDataReader):
                     'data not available within the first %d output.' %
                     self.limit)
 
+            self.values = self.alignData()
+
+    def alignData(self):
+        '''
+        将所有品种一次性对齐到wholeIndex上
+        :return: 时间 × field × 期货品种 的数组, 品种与registeredInstruments对齐, 缺失的时间为nan
+        '''
+        values = np.full((len(self.wholeIndex), len(self.fields), len(self.registeredInstruments)), np.nan)
+        for i, future in enumerate(self.registeredInstruments):
+            df = self.futureDict[future]
+            df = df[~df.index.duplicated(keep='first')]  # 有些品种的数据中有些交易日的11:30:00会有两条记录！此时只取第一条
+            rows = df.index.get_indexer(self.wholeIndex)
+            present = np.flatnonzero(rows >= 0)  # 有些品种在一些时间会有数据缺失，此时用nan填充
+            values[present, :, i] = df[self.fields].values[rows[present]]
+        return values
+
     def prepareGenerator(self):
         '''
         初始化生成器
@@ -460,41 +631,15 @@ class CSVFutureDataReader(BaseDataReader):
         数据生成器
         :return:  返回每一个时间的数据查询结果
         '''
+        values = self.values
+        instruments = np.asarray(self.registeredInstruments)
         for idx, date in enumerate(self.wholeIndex):
-            df = self.adjustData(date)
-            print(df)
-            yield date, df
-            del df
+            ret = values[idx]  # field × 期货品种, 行与fields对齐, 列与registeredInstruments对齐
+            self.currentInstruments = instruments[~np.isnan(ret).any(axis=0)].tolist()
+            yield pd.Timestamp(date), ret
             if idx == len(self.wholeIndex) - 2:  # 如果输出完了全部的数据，把终止信号设为TRUE
                 self.isEof = True
 
-    def adjustData(self, date):
-        '''
-        调整输出的数据格式的函数
-        :param date: 要查询的数据对应的时间（datetime格式）
-        :return:
-        '''
-        combined = pd.DataFrame()
-        toAddList = []
-        for future in self.registeredInstruments:  # 遍历要查询的品种
-            tmp = self.futureDict[future].copy()
-            tmp = tmp[tmp.index == date].reset_index()  # 取对应时间的数据
-            if len(tmp) > 0:
-                tmp = pd.DataFrame(tmp.iloc[0]).T  # 有些品种的数据中有些交易日的11:30:00会有两条记录！此时只取第一条
-            else:
-                tmp = pd.DataFrame(index=[0], columns=tmp.columns)  # 有些品种在一些时间会有数据缺失，此时用nan填充
-                # tmp.loc[0,'symbol']=self.allFutures[future][:-4]
-                tmp.loc[0, 'symbol'] = future
-            combined = pd.concat([combined, tmp])
-            del tmp
-        combined = combined.drop(['datetime'], axis=1).set_index('symbol')  # 删去'datetime'列，把'symbol'设置为索引，并转置
-
-        tmp = combined.dropna(axis=0, how='any')
-        self.currentInstruments = list(tmp.index)
-        del tmp
-
-        return combined
-
     def getDir(self):
         '''
         返回期货的本地数据路径
@@ -601,35 +746,28 @@ class CSVFinanceReader(BaseDataReader):
         '''
         self.df = pd.read_csv(self.filePath)
         self.df = self.df[pd.notnull(self.df["ANN_DT"])]  # 删除公告日期为NAN的行
-        self.df["ANN_DT"] = pd.to_datetime(self.df["ANN_DT"], format="%Y%m%d")
-        self.df["ANN_DT"] = self.df["ANN_DT"].dt.date
+        self.df["ANN_DT"] = pd.to_datetime(self.df["ANN_DT"].astype(np.int64).astype(str), format="%Y%m%d")
 
         if self.start:  # 取开始时间之后的数据
-            self.df = self.df[self.df["ANN_DT"] > pd.Timestamp(self.start).date()]
+            self.df = self.df[self.df["ANN_DT"] > pd.Timestamp(self.start).normalize()]
         if self.end:  # 取结束时间之前的数据
-            self.df = self.df[self.df["ANN_DT"] < pd.Timestamp(self.end).date()]
+            self.df = self.df[self.df["ANN_DT"] < pd.Timestamp(self.end).normalize()]
         self.df[["WIND_CODE", "temp"]] = self.df["WIND_CODE"].str.split(".", expand=True)  # 删除股票代码后缀，保留数字
         self.df.drop(columns="temp", inplace=True)
         self.availInstruments = sorted(set(self.df["WIND_CODE"]) & set(self.instruments))  # 取股票代码交集，并排序
         self.df = self.df[self.df["WIND_CODE"].isin(self.availInstruments)]  # 删除不在股票代码集合中的行
 
         # 当出现同一公告日同一股票多条数据的情况时，将公告日递延一天
-        self.df.sort_values(by=["WIND_CODE", "ANN_DT"], inplace=True)
-        self.df.reset_index(inplace=True)
-        boolDF = self.df[["WIND_CODE", "ANN_DT"]].eq(self.df[["WIND_CODE", "ANN_DT"]].shift(1)).all(axis="columns")
-        duplicatedRowIndex = boolDF.index[boolDF == True].tolist()
-        for idx in duplicatedRowIndex:
-            datePlusOne = self.df.iloc[idx - 1]["ANN_DT"] + datetime.timedelta(days=1)
-            self.df.loc[idx, "ANN_DT"] = datePlusOne
-            if idx <= len(self.df) - 2:
-                if self.df.loc[idx]["ANN_DT"] == self.df.loc[idx + 1]["ANN_DT"]:
-                    self.df.loc[idx + 1, "ANN_DT"] = self.df.iloc[idx]["ANN_DT"] + datetime.timedelta(days=1)
+        self.df = self.df.sort_values(by=["WIND_CODE", "ANN_DT"], kind="mergesort")
+        self.df["ANN_DT"] = deferDuplicateDates(self.df["WIND_CODE"].values, self.df["ANN_DT"].values)
 
         self.df.set_index(["ANN_DT", "WIND_CODE"], inplace=True)  # 设置双index，并排序
         self.df.sort_index(axis=0, inplace=True)
         self.df = self.df[self.fields]  # 取所需字段的数据，删除其他列
 
-        self.allDate = [date for date in np.unique(self.df.index.get_level_values(level="ANN_DT"))]  # 生成一个含所有日期的列表
+        # 公告日 × field × instrument 的变更记录, 可按时间点对齐到分钟或日频时间轴
+        self.changeLog = FinanceChangeLog.from_frame(self.df, self.availInstruments, self.fields)
+        self.allDate = [pd.Timestamp(date) for date in self.changeLog.getDates()]  # 生成一个含所有日期的列表
         self.valGen = self.valueGenerator()  # 生成generator并赋值
 
         return self.df
@@ -637,17 +775,12 @@ class CSVFinanceReader(BaseDataReader):
     def valueGenerator(self):
         '''
         生成器
-        return: 从df中读取下一个时间的数据，返回时间和一个dataframe，行是股票代码，列是所选字段
+        return: 从变更记录中读取下一个公告日的数据，返回时间和一个 field × instrument 数组，
+                列与availInstruments对齐，当日未公告的股票为nan
         '''
+        block = self.changeLog.getBlock()
         for idx, date in enumerate(self.allDate):
-            tempDF = self.df.loc[date]
-            # tempDF = tempDF[~tempDF.index.duplicated(keep="first")]  # 使用递延处理，这里注释掉只保留一行的处理
-            # 生成一个列表，列表包含存在于股票交集而不在tempDF中的股票
-            emptyInsList = [ins for ins in self.availInstruments if ins not in tempDF.index.values]
-            emptyDF = pd.DataFrame(columns=self.fields, index=emptyInsList)  # 生成一个只包含行名和列名的空dataframe
-            tempDF = tempDF.append(emptyDF)
-            tempDF.sort_index(inplace=True)
-            yield date, tempDF
+            yield date, block[idx]
 
             if idx == len(self.allDate) - 2:
                 self.isEof = True
@@ -659,6 +792,13 @@ class CSVFinanceReader(BaseDataReader):
         '''
         return self.filePath
 
+    def getChangeLog(self):
+        '''
+        返回变更记录
+        return: FinanceChangeLog, 可通过asof/to_static_panels对齐到PanelFeed的时间轴
+        '''
+        return self.changeLog
+
     def getFrequency(self):
         '''
         返回数据周期
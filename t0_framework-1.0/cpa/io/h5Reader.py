@@ -6,6 +6,12 @@
 '''
 
 import os
+import pickle
+import queue
+import re
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 
@@ -15,6 +21,197 @@ from cpa.utils import bar, series
 from cpa.utils import logger
 from cpa.config.pathSelector import platformSectionSelector
 
+# PyTables不是线程安全的, 预读取线程与主线程的h5读取需串行
+H5_LOCK = threading.RLock()
+# 预读取线程结束时放入队列的终止标记
+PREFETCH_END = None
+
+
+def readH5File(path):
+    '''
+    :param path: h5文件路径
+    :return: 文件中的dataframe或series, 可在进程池中调用
+    '''
+    with H5_LOCK:
+        return pd.read_hdf(path_or_buf=path)
+
+
+def readH5DateRange(path):
+    '''
+    :param path: h5文件路径
+    :return: (起始时间, 截止时间), table格式只读取首尾两行, fixed格式读取整个文件
+    '''
+    with H5_LOCK:
+        with pd.HDFStore(path, mode='r') as store:
+            key = store.keys()[0]
+            storer = store.get_storer(key)
+            if not storer.is_table:
+                index = store.select(key).index
+                return index[0], index[-1]
+            nrows = storer.nrows
+            return (store.select(key, start=0, stop=1).index[0],
+                    store.select(key, start=nrows - 1, stop=nrows).index[0])
+
+
+def readH5Columns(path, columns=None):
+    '''
+    读取h5文件中的dataframe, 只读取需要的列(股票)
+    table格式直接按列select; fixed格式只读取所需股票所在的列区间, 避免解码整个市场的数据
+    :param path: h5文件路径
+    :param columns: 需要读取的列, None则读取全部列, 文件中不存在的列会被忽略
+    :return: dataframe, 列的顺序与文件中一致
+    '''
+    with H5_LOCK:
+        with pd.HDFStore(path, mode='r') as store:
+            key = store.keys()[0]
+            if columns is None:
+                return store.select(key)
+            wanted = set(columns)
+            storer = store.get_storer(key)
+            if storer.is_table:
+                available = storer.non_index_axes[0][1]
+                return store.select(key, columns=[col for col in available if col in wanted])
+
+            node = getattr(storer.group, 'block0_values', None)
+            if getattr(storer.attrs, 'nblocks', None) != 1 or node is None \
+                    or getattr(node._v_attrs, 'value_type', None) is not None \
+                    or getattr(node._v_attrs, 'shape', None) is not None:
+                # 多个block或非数值数据, 读取全部后再筛选
+                df = store.select(key)
+                return df[[col for col in df.columns if col in wanted]]
+
+            items = storer.read_index('block0_items')
+            index = storer.read_index('axis1')
+            positions = np.array([i for i, col in enumerate(items) if col in wanted], dtype=np.int64)
+            if len(positions) == 0:
+                return pd.DataFrame(index=index, columns=items[:0])
+            lo, hi = positions[0], positions[-1] + 1
+            if getattr(node._v_attrs, 'transposed', False):
+                values = node[:, lo:hi][:, positions - lo]  # 存储为 时间 × 股票
+            else:
+                values = node[lo:hi][positions - lo].T  # 存储为 股票 × 时间
+            return pd.DataFrame(values, index=index, columns=items[positions])
+
+
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+
+def toMinuteIndex(index):
+    '''
+    将('date', 'time')两层索引转换为分钟级的DatetimeIndex
+    :param index: h5文件中的MultiIndex, 'date'为日期, 'time'为HHMM格式的整数, 如931
+    :return: 名称为'datetime'的DatetimeIndex
+    '''
+    dates = np.asarray(index.get_level_values('date').values, dtype='datetime64[D]')
+    times = np.asarray(index.get_level_values('time'), dtype=np.int64)
+    minutes = (times // 100) * 60 + times % 100  # HHMM转换为当日的分钟数
+    dateTimes = dates.astype('datetime64[ns]') + minutes.astype('timedelta64[m]')
+    return pd.DatetimeIndex(dateTimes, name='datetime')
+
+
+def fieldDtype(dataName):
+    '''
+    价格字段使用float32, 成交量、成交额等其余字段使用float64以免丢失精度
+    '''
+    return np.dtype(np.float32) if dataName in PRICE_FIELDS else np.dtype(np.float64)
+
+
+def roundField(df, dataName):
+    '''
+    按字段统一数据精度: 成交量取整到百股, 成交额取整, 其余保留两位小数
+    :param df: 某个字段的数据
+    :param dataName: 字段名称
+    :return: 处理后的dataframe
+    '''
+    if (dataName == 'volume'):
+        return (df / 100).round(0) * 100
+    elif (dataName == 'amount'):
+        return df.round(0)
+    else:
+        return df.round(2)
+
+
+class H5DataCatalog:
+    '''
+    月度h5数据目录的元数据缓存, 以pickle形式保存在数据目录下
+    记录每个月trdstat.h5的交易时间和股票列表, 以及start_end_date.xlsx上市退市表
+    每条记录带有源文件的修改时间, 源文件更新后自动重新读取
+    '''
+    logger = logger.getLogger("H5DataCatalog")
+
+    CATALOG_FILE = 'catalog.pickle'
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.catalogPath = os.path.join(path, self.CATALOG_FILE)
+        self.changed = False
+        self.entries = self.load()
+
+    def load(self):
+        '''
+        :return: 读取已保存的目录, 不存在或版本不一致时返回空目录
+        '''
+        if os.path.exists(self.catalogPath):
+            try:
+                with open(self.catalogPath, 'rb') as f:
+                    catalog = pickle.load(f)
+                if catalog.get('version') == self.VERSION:
+                    return catalog['entries']
+            except Exception as e:
+                self.logger.warning("Failed to load catalog {}: {}".format(self.catalogPath, e))
+        return {}
+
+    def save(self):
+        '''
+        有更新时写回目录文件, 先写临时文件再替换, 数据目录只读时只记录日志
+        '''
+        if not self.changed:
+            return
+        tmpPath = self.catalogPath + '.tmp'
+        try:
+            with open(tmpPath, 'wb') as f:
+                pickle.dump({'version': self.VERSION, 'entries': self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, self.catalogPath)
+            self.changed = False
+        except OSError as e:
+            self.logger.warning("Failed to save catalog {}: {}".format(self.catalogPath, e))
+
+    def getCached(self, relPath, loadFunc):
+        '''
+        :param relPath: 相对数据目录的源文件路径, 作为目录的键
+        :param loadFunc: 源文件有更新或未记录时调用, 返回需要缓存的内容
+        :return: 缓存的内容
+        '''
+        mtime = os.path.getmtime(os.path.join(self.path, relPath))
+        entry = self.entries.get(relPath)
+        if entry is None or entry['mtime'] != mtime:
+            self.logger.debug("Cataloging {}.".format(relPath))
+            entry = {'mtime': mtime, 'data': loadFunc()}
+            self.entries[relPath] = entry
+            self.changed = True
+        return entry['data']
+
+    def getStartEnd(self):
+        '''
+        :return: 股票上市、退市日期表
+        '''
+        return self.getCached('start_end_date.xlsx', lambda: pd.read_excel(
+            os.path.join(self.path, 'start_end_date.xlsx'), dtype={'index': str}))
+
+    def getMonth(self, reader, date):
+        '''
+        :param reader: 用于解析h5文件的H5DataReader
+        :param date: 月份
+        :return: {'timeLine': 当月排序后的交易时间(datetime64), 'columns': 当月全部股票代码}
+        '''
+        def loadMonth():
+            df = reader.fileterH5File(self.path, date, 'trdstat', filterColumns=False)
+            return {'timeLine': np.unique(df.index.values), 'columns': list(df.columns)}
+
+        relPath = os.path.join(str(date)[0:4], str(int(str(date)[5:7])), 'trdstat.h5')
+        return self.getCached(relPath, loadMonth)
+
 
 class H5DataReader(BaseDataReader):
     '''
@@ -30,12 +227,14 @@ class H5DataReader(BaseDataReader):
             fields=None,
             start=None,
             end=None,
-            limit=-1):
+            limit=-1,
+            prefetch=0):
         '''
         :param frequency: 数据周期
         :param instruments: 所选股票code
         :param fields: 所选字段,高开低收等
         :param startTime: 起始时间
+        :param prefetch: 后台线程预先读取并转换的月份数, 0表示在月末同步读取下个月
         '''
         super().__init__(instruments, fields, start)
         self.frequency = frequency
@@ -68,6 +267,14 @@ class H5DataReader(BaseDataReader):
         self.actualStart = None
         self.actualEnd = None
         self.currentInstruments = []  # 储存当前返回的dataframe中的股票
+        self.monthBlock = None  # 当月数据块, 时间 × field × instrument
+        self.currentValues = None  # 最近一次输出的 field × instrument 数据
+        self.prefetch = prefetch
+        self.prefetchQueue = None  # 预读取完成的月份数据 (timeLine, block)
+        self.prefetchThread = None
+        self.prefetchStopped = threading.Event()
+        self.columnMapCache = None  # 文件列到registeredInstruments的整数索引
+        self.endDates = None  # 与registeredInstruments对齐的退市日期
 
         self.setFilePath()
 
@@ -85,10 +292,20 @@ class H5DataReader(BaseDataReader):
                 const.DataType.OHLCV,
                 const.DataFrequency.freq2lable(
                     self.frequency))
+        self.catalog = H5DataCatalog(self.path)
         # 用self.startEnd读取存放股票的上市、退市日期
-        self.startEnd = pd.read_excel(os.path.join(self.path, 'start_end_date.xlsx'), dtype={'index': str})
-        self.indexConstituent = pd.read_pickle(os.path.join(self.path, 'indexconstituent.pickle'))
+        self.startEnd = self.catalog.getStartEnd()
+        self.indexConstituent = None  # 指数成分股在查询指数时才读取
         self.totalLength = self.getTotalLength()
+        self.catalog.save()
+
+    def getIndexConstituent(self):
+        '''
+        :return: 指数成分股字典, 首次调用时读取
+        '''
+        if self.indexConstituent is None:
+            self.indexConstituent = pd.read_pickle(os.path.join(self.path, 'indexconstituent.pickle'))
+        return self.indexConstituent
 
     def getTotalLength(self):
         '''
@@ -97,10 +314,11 @@ class H5DataReader(BaseDataReader):
         totalLength = 0
         totalIndex = []
         tmpTimeLine = self.appliedTimeLine.copy()
+        start, end = np.datetime64(self.start), np.datetime64(self.end)
         for i in np.arange(len(tmpTimeLine)):
-            df = self.fileterH5File(self.path, tmpTimeLine[i], 'trdstat')
-            tmp = list([j for j in np.unique(df.index)  # 记录每个月内，交易时间介于start和end之间的数量
-                        if (pd.to_datetime(j) <= self.end) & (pd.to_datetime(j) >= self.start)])
+            month = self.catalog.getMonth(self, tmpTimeLine[i])  # 从目录中读取当月的交易时间
+            timeLine = month['timeLine']
+            tmp = list(timeLine[(timeLine <= end) & (timeLine >= start)])  # 记录每个月内，交易时间介于start和end之间的数量
             totalIndex = totalIndex + tmp
             self.logger.debug("Checking timeline {}.".format(tmpTimeLine[i]))
             if (self.actualStart == None) & (len(tmp) > 0):
@@ -118,7 +336,7 @@ class H5DataReader(BaseDataReader):
                     self.actualEnd = totalIndex[-1]
                     break
         if self.instruments == None:
-            self.registeredInstruments = list(df.columns)
+            self.registeredInstruments = list(month['columns'])
         self.totalIndex = totalIndex
 
         return len(totalIndex)  # 返回 limit和totalLength中的小值
@@ -131,7 +349,7 @@ class H5DataReader(BaseDataReader):
         :return:  成分股列表
         '''
         date = str(date)[:10]
-        constituentStock = self.indexConstituent[index][date]['code'].tolist()
+        constituentStock = self.getIndexConstituent()[index][date]['code'].tolist()
         constituentStockUpdate = []
 
         # 股票代码处理：去掉后面的字母，只保留前六位数字
@@ -140,109 +358,245 @@ class H5DataReader(BaseDataReader):
 
         return constituentStockUpdate
 
-    def fileterH5File(self, folder, date, dataName):
+    def fileterH5File(self, folder, date, dataName, filterColumns=True):
         '''
         :param folder:  存储股票分钟数据的总文件夹路径
         :param date:   要读取的数据的日期，数据类型为datetime
         :param dataName:  要读取的字段名称，数据类型为字符串，如'close'
+        :param filterColumns: 是否只保留所查询的股票, False时保留文件中的全部股票
         :return:   返回一个dataframe,索引为分钟级的datetime，列为需要查询的股票代码
         '''
         year = str(date)[0:4]  # 设置年份、月份，和文件路径
         month = str(int(str(date)[5:7]))
         dataname = str(dataName) + '.h5'
         path = os.path.join(folder, year, month, dataname)
-        df = pd.read_hdf(path)  # 读取h5文件，只保留需要需要查询的股票
-        if (self.instruments is None) or (self.instruments == 'SZ50') or (self.instruments == 'HS300') or (self.instruments == 'ZZ500'):
-            cols = (df.columns)
-        else:
-            cols = (df.columns) & self.instruments  # 若查询特定的股票列表，则取交集
-        # 重新设置索引为'datetime',格式为1min级别的datetime，删去先前的'date','time'两列
-
-        if platformSectionSelector() == 'lixiao':
-            # 百度网盘数据
-            df = df[cols].reset_index()
-            df['datetime'] = pd.to_datetime(
-                df['date'].dt.strftime('%Y%m%d') +
-                df['time'].apply(str).str.zfill(4))
-            df = df.drop(['date', 'time'], axis=1)
-            df = df.set_index('datetime')
-        elif "xuefu" in platformSectionSelector():
-            # 服务器数据
-            df = df[cols]
-        else:
-            # 百度网盘数据
-            df = df[cols].reset_index()
-            df['datetime'] = pd.to_datetime(
-                df['date'].dt.strftime('%Y%m%d') +
-                df['time'].apply(str).str.zfill(4))
-            df = df.drop(['date', 'time'], axis=1)
-            df = df.set_index('datetime')
-
-        if (dataName == 'volume'):
-            return (df / 100).round(0) * 100
-        elif (dataName == 'amount'):
-            return df.round(0)
-        else:
-            return df.round(2)
+        df = readH5Columns(path, self.getNeededColumns() if filterColumns else None)  # 读取h5文件，只读取需要查询的股票
 
-    def getNeededData(self, dataName):
+        if "xuefu" not in platformSectionSelector():
+            # 百度网盘数据, 重新设置索引为'datetime',格式为1min级别的datetime，替换先前的'date','time'两层索引
+            df.index = toMinuteIndex(df.index)
+
+        return roundField(df, dataName)
+
+    def getNeededColumns(self):
+        '''
+        :return: 读取h5文件时需要的股票列表, None表示需要全部股票
+                 指数在确定registeredInstruments后只读取成分股, 股票列表在确定后只读取其中仍在市场中的股票
+        '''
+        if self.instruments is None:
+            return None
+        if self.initialSignal == 1:
+            return self.registeredInstruments
+        if self.isIndexUniverse():
+            return None
+        return self.instruments
+
+    def getNeededData(self, dataName, date=None):
         '''
         根据输入的字段名称,获取对应字段数据，每次调用返回1个月的数据
         :param dataName: 要查询的字段名称，如'close'
+        :param date: 所要读取的月份, None则为appliedTimeLine的第一个值
         :return: 返回一个dataframe
         '''
-        date = self.appliedTimeLine[0]  # 所要读取的日期为，appliedTimeLine的第一个值
+        if date is None:
+            date = self.appliedTimeLine[0]  # 所要读取的日期为，appliedTimeLine的第一个值
         df = self.fileterH5File(self.path, date, dataName)
         df = df[(df.index >= self.start)]  # 只保留查询起始日期start之后的那些行
-        df['field'] = dataName  # 新加一列，列名为'field',值全部填充为该字段的名字
         year = str(date)[0:4]
         month = str(int(str(date)[5:7]))
         self.logger.info("{} {} {} data got.".format(year, month, dataName))
         return df
 
-    def getAllFields(self):
+    def getMonthFrames(self, date=None):
         '''
-        这是获取每个所需字段数据的函数
-        :return:
+        读取一个月内所有所需字段的数据
+        :param date: 所要读取的月份, None则读取appliedTimeLine的第一个月份并将其pop掉
+        :return: {field: dataframe}, 索引为datetime, 列为股票代码
         '''
-        df = pd.DataFrame()
-        for field in self.fields:  # 遍历需要查询的字段
-            tmp = self.getNeededData(field)
-            df = pd.concat([df, tmp])
-            del tmp
-        if len(self.appliedTimeLine) > 0:  # 如果所读取的月份不是本地的最后一个月份，那么把第一个值pop掉
+        frames = {}
+        for field in self.fields:
+            frames[field] = self.getNeededData(field, date)
+        if date is None and len(self.appliedTimeLine) > 0:  # 如果所读取的月份不是本地的最后一个月份，那么把第一个值pop掉
             self.appliedTimeLine.pop(0)
-        return df
+        return frames
+
+    def startPrefetch(self):
+        '''
+        启动后台线程, 按顺序读取并转换appliedTimeLine中剩余的月份, 最多缓存prefetch个月
+        '''
+        self.prefetchQueue = queue.Queue(maxsize=self.prefetch)
+        # 线程只持有reader的弱引用, reader被回收时__del__可以停止线程
+        self.prefetchThread = threading.Thread(target=H5DataReader.prefetchWorker,
+                                               args=(weakref.ref(self), list(self.appliedTimeLine),
+                                                     self.prefetchQueue, self.prefetchStopped),
+                                               name='H5DataReaderPrefetch',
+                                               daemon=True)
+        self.prefetchThread.start()
+
+    @staticmethod
+    def prefetchWorker(readerRef, months, prefetchQueue, stopped):
+        '''
+        :param readerRef: reader的弱引用
+        :param months: 需要预读取的月份列表
+        :param prefetchQueue: 预读取队列
+        :param stopped: 停止信号
+        读取出错时将异常放入队列, 无论如何退出, 最后都会放入终止标记PREFETCH_END, 由主线程取出后抛出
+        '''
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    prefetchQueue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for date in months:
+                reader = readerRef()
+                if reader is None or stopped.is_set():
+                    return
+                try:
+                    item = reader.pivotMonth(reader.getMonthFrames(date))
+                except Exception as e:
+                    item = e
+                del reader  # 等待队列时不持有reader
+                if not put(item) or isinstance(item, Exception):
+                    return
+        finally:
+            put(PREFETCH_END)
+
+    def getPrefetched(self):
+        '''
+        :return: 从预读取队列中取出下一个月的(timeLine, block), 并同步pop掉appliedTimeLine
+                 预读取线程出错时抛出其异常, 线程提前结束时抛出Exception
+        '''
+        while True:
+            try:
+                item = self.prefetchQueue.get(timeout=0.5)
+                break
+            except queue.Empty:
+                # 线程已退出且队列为空(被stopPrefetch停止), 不再等待
+                if not self.prefetchThread.is_alive() and self.prefetchQueue.empty():
+                    raise Exception("Prefetch thread has stopped, no more data.")
+        if isinstance(item, Exception):
+            raise item
+        if item is PREFETCH_END:
+            raise Exception("Prefetch thread has stopped, no more data.")
+        self.appliedTimeLine.pop(0)
+        return item
+
+    def stopPrefetch(self):
+        '''
+        停止后台预读取并释放已缓存的数据, 等待正在读取的月份完成
+        '''
+        self.prefetchStopped.set()
+        if self.prefetchThread is not None and self.prefetchThread is not threading.current_thread():
+            self.prefetchThread.join()
+        if self.prefetchQueue is not None:
+            while not self.prefetchQueue.empty():
+                self.prefetchQueue.get_nowait()
+
+    def close(self):
+        '''
+        停止预读取线程, 不再继续读取时调用
+        '''
+        self.stopPrefetch()
+
+    def __del__(self):
+        # 对象创建失败时prefetchThread可能不存在
+        if getattr(self, 'prefetchThread', None) is not None:
+            self.stopPrefetch()
+
+    def isIndexUniverse(self):
+        return (self.instruments == 'SZ50') or (self.instruments == 'HS300') or (self.instruments == 'ZZ500')
+
+    def getColumnMap(self, columns):
+        '''
+        计算文件中的列与registeredInstruments的对应关系, 同一个月的各字段列相同, 结果缓存复用
+        :param columns: h5文件读出的列
+        :return: (source, target) 两个整数数组, 文件中第source列写入block的第target列
+        '''
+        cached = self.columnMapCache
+        if cached is not None and cached[0].equals(columns):
+            return cached[1], cached[2]
+        target = pd.Index(self.registeredInstruments).get_indexer(columns)
+        source = np.flatnonzero(target >= 0)
+        target = target[source]
+        self.columnMapCache = (columns, source, target)
+        return source, target
+
+    def getEndDates(self):
+        '''
+        :return: 与registeredInstruments对齐的退市日期数组(datetime64), 退市日期缺失的为NaT, registeredInstruments确定后只计算一次
+                 同一代码有多条记录时取最晚的退市日期, 与原先任意一条end_date > date即视为未退市一致
+        '''
+        if self.endDates is None:
+            endDate = pd.to_datetime(self.startEnd['end_date']).groupby(self.startEnd['index']).max()
+            self.endDates = pd.to_datetime(endDate.reindex(self.registeredInstruments)).values
+        return self.endDates
+
+    def pivotMonth(self, frames):
+        '''
+        将一个月的数据一次性转换为稠密数组，逐分钟输出时只需切片
+        :param frames: getMonthFrames的返回值
+        :return: timeLine(排序后的datetime64), block(时间 × field × registeredInstruments, 只有价格字段时为float32, 否则为float64)
+        '''
+        timeLine = np.unique(np.concatenate([frame.index.values for frame in frames.values()]))
+        timeLine = timeLine[timeLine <= np.datetime64(self.end)]  # 只保留不大于end的时间
+
+        dtype = np.result_type(*[fieldDtype(field) for field in self.fields])
+        block = np.full((len(timeLine), len(self.fields), len(self.registeredInstruments)), np.nan, dtype=dtype)
+        for i, field in enumerate(self.fields):
+            frame = frames[field]
+            frame = frame[~frame.index.duplicated(keep='first')]
+            rows = frame.index.get_indexer(timeLine)
+            present = np.flatnonzero(rows >= 0)
+            source, target = self.getColumnMap(frame.columns)
+            fieldBlock = block[:, i, :]
+            # 先转换为字段自身的dtype, 与block的公共dtype不同时价格字段仍保持float32精度
+            fieldBlock[np.ix_(present, target)] = frame.values[np.ix_(rows[present], source)].astype(fieldDtype(field))
+
+        if not self.isIndexUniverse():
+            # 该时间已经退市的股票置为nan, 与原先只保留end_date > date的股票一致, 退市日期缺失的股票同样置为nan
+            delisted = ~(timeLine[:, None] < self.getEndDates()[None, :])
+            block[np.broadcast_to(delisted[:, None, :], block.shape)] = np.nan
+
+        return timeLine, block
 
     def prepareOutputData(self):
         '''
-        准备数据，存进self.dfs里面
+        准备数据，将一个月的数据转换为 时间 × field × instrument 的数组存进self.monthBlock
         '''
-        dfs = self.getAllFields()  # 调用getAllFields函数，得到拼接好的1个月数据
-        # 将df根据'datetime'和'field'排序
+        if self.prefetchQueue is not None:
+            self.currentTimeLine, self.monthBlock = self.getPrefetched()
+            return
+
+        if self.initialSignal == 0 and self.isIndexUniverse():
+            # 指数成分股只依赖于actualStart, 先确定下来, 读取时只需读取成分股的列
+            self.registeredInstruments = self.setRegisteredInstruments()
+            self.initialSignal = 1
+            self.currentInstruments = self.registeredInstruments
+
+        frames = self.getMonthFrames()  # 调用getMonthFrames函数，得到1个月各字段的数据
 
-        toDel = [col for col in dfs.columns if (col not in list(self.startEnd['index'])) & (col != 'field')]
-        dfs = dfs.drop(toDel, axis=1)  # 把市场中没有的股票代码统一去除
-        dfs = dfs.sort_values(['datetime', 'field'])
         if self.initialSignal == 0:
-            if (self.instruments == 'SZ50') or (self.instruments == 'HS300') or (self.instruments == 'ZZ500'):
-                self.registeredInstruments = self.setRegisteredInstruments()
+            listed = set(self.startEnd['index'])
+            if self.instruments is not None:
+                tmp = [col for col in frames[self.fields[0]].columns if col in listed]  # 把市场中没有的股票代码统一去除
             else:
-                if self.instruments is not None:
-                    tmp = list(dfs.columns)[:-1]
-                else:
-                    tmp = [j for j in (self.registeredInstruments) if j in list(self.startEnd['index'])]
-                beforeDelisted = list(self.startEnd[(self.startEnd['end_date'] >= self.actualStart)]['index'])
-                afterlisted = list(self.startEnd[(self.startEnd['start_date'] <= self.actualEnd)]['index'])
-                self.registeredInstruments = sorted([j for j in tmp if (j in beforeDelisted) & (j in afterlisted)])
+                tmp = [j for j in (self.registeredInstruments) if j in listed]
+            beforeDelisted = list(self.startEnd[(self.startEnd['end_date'] >= self.actualStart)]['index'])
+            afterlisted = list(self.startEnd[(self.startEnd['start_date'] <= self.actualEnd)]['index'])
+            self.registeredInstruments = sorted([j for j in tmp if (j in beforeDelisted) & (j in afterlisted)])
             self.initialSignal = 1
             self.currentInstruments = self.registeredInstruments
 
-        if self.instruments == None:
-            dfs = pd.DataFrame(dfs, columns=self.registeredInstruments + ['field'])
-        self.dfs = dfs
-        tmp = np.unique(dfs.index)  # 用tmp储存当前读取出的这个月份的数据的所有交易分钟
-        self.currentTimeLine = [j for j in tmp if pd.to_datetime(j) <= self.end]  # 把这些交易时间中，不大于end的时间，用currentTimeLine储存
+        self.currentTimeLine, self.monthBlock = self.pivotMonth(frames)
+
+        # registeredInstruments确定后才能转换后续月份, 此时再启动预读取
+        if self.prefetch > 0 and self.prefetchThread is None and len(self.appliedTimeLine) > 0:
+            self.startPrefetch()
 
     def prepareGenerator(self):
         '''
@@ -261,28 +615,29 @@ class H5DataReader(BaseDataReader):
     def valueGenerator(self):
         '''
         生成器
-        :return:从dfs中读取下一个时间的数据,返回时间和一个dataframe：行为code,列为高开低收量
+        :return:从当月数据块中读取下一个时间的数据,返回时间和一个 field × instrument 数组,
+                行与fields对齐, 列与registeredInstruments对齐, 可直接写入PanelFeed
         '''
         if self.limit - self.outputTimes == 0:
             self.isEof = True
-        for idx, date in enumerate(
-                self.currentTimeLine):  # 遍历currentTimeLine中的时间
-
-            tmp = self.dfs[self.dfs.index == date]  # 获取每一分钟的数据，将索引设置为'field'
-            ret = self.adjustData(tmp, date)  # 调用adjusatData函数，对输出数据的格式进行调整
-            ret = ret.set_index('field').T  # 转置矩阵
-            ret.index.names = ['code']
-            if idx == len(self.currentTimeLine) - 1:  # 把数据全部逐条输出完成后，进行如下判断
+        timeLine, block = self.currentTimeLine, self.monthBlock  # 后续prepareGenerator会替换为下个月的数据
+        for idx in range(len(timeLine)):  # 遍历currentTimeLine中的时间
+
+            ret = block[idx]
+            if idx == len(timeLine) - 1:  # 把数据全部逐条输出完成后，进行如下判断
                 if len(self.appliedTimeLine) == 0:
                     self.isEof = True  # 若本地已经没有可查询的数据，把self.isEof设置为True
+                    self.stopPrefetch()
                 else:
                     self.prepareGenerator()  # 否则，调用prepareGenerator函数,初始化生成器
 
             self.outputTimes += 1  # 输出数据，并记录输出次数
-            yield pd.to_datetime(date), ret
+            self.currentValues = ret
+            yield pd.Timestamp(timeLine[idx]), ret
 
             if (self.outputTimes == self.limit):
                 self.isEof = True
+                self.stopPrefetch()
 
     def setRegisteredInstruments(self):
         '''
@@ -298,39 +653,6 @@ class H5DataReader(BaseDataReader):
             raise '%s未记录成分股' % self.instruments
         return sorted(cols)
 
-    def adjustData(self, df, date):
-        '''
-                对输出的数据进行格式加工
-                :param df:  时间对应的股票数据，格式为dataframe
-                :param date:  分钟级别的一个时间，格式为datetime
-                :return: 返回一个处理后的股票数据dataframe
-        '''
-        if (self.instruments == 'SZ50') or (self.instruments == 'HS300') or (self.instruments == 'ZZ500'):
-            if self.instruments == 'SZ50':
-                cols = sorted(self.indexConstituentList(index=50, date=self.start)) + ['field']
-            elif self.instruments == 'HS300':
-                cols = sorted(self.indexConstituentList(index=300, date=self.start)) + ['field']
-            elif self.instruments == 'ZZ500':
-                cols = sorted(self.indexConstituentList(index=500, date=self.start)) + ['field']
-            else:
-                raise '%s未记录成分股' % self.instruments
-            df = df[cols]
-            self.currentInstruments = list(df.columns)[:-1]  # 更新当前包含的股票代码
-
-        else:  # 如果instruments不是指数
-
-            # 存储该时间，已经退市的股票代码
-
-            notDelisted = list(self.startEnd[(self.startEnd['end_date'] > date)]['index'])
-            df = pd.DataFrame(df, columns=notDelisted + ['field'])
-            df = pd.DataFrame(df, columns=self.registeredInstruments + ['field'])
-
-            tmp = df.dropna(axis=1, how='any')
-            self.currentInstruments = list(tmp.columns).remove('field')
-            del tmp
-
-        return df
-
     def getRegisteredInstruments(self):
         '''
          :return: 返回实际使用的instruments
@@ -390,7 +712,10 @@ class H5DataReader(BaseDataReader):
         '''
         :return: 返回当前时刻，在市场中正常交易（已上市，未退市）的股票列表； 若查询的是指数，则返回当前该指数的成分股
         '''
-        return self.currentInstruments
+        if self.isIndexUniverse() or self.currentValues is None:
+            return self.currentInstruments
+        valid = ~np.isnan(self.currentValues).any(axis=0)
+        return np.asarray(self.registeredInstruments)[valid].tolist()
 
 
 class H5PanelReader(BasePanelReader):
@@ -423,12 +748,13 @@ class H5PanelReader(BasePanelReader):
         self.staticSeries = None
         self.iterator = None
 
-    def retrieve(self):
+    def retrieve(self, df=None):
         '''
         获取数据，存入dataframe
+        :param df: 已在其他进程中读取好的数据, None则读取文件
         '''
         # 读取单个文件
-        self.df = pd.read_hdf(path_or_buf=self.dir)
+        self.df = readH5File(self.dir) if df is None else df
         # 若未输入所需开始时间，则取数据自身的开始时间
         self.start = pd.Timestamp(
             self.start) if self.start else self.df.index[0]
@@ -445,13 +771,20 @@ class H5PanelReader(BasePanelReader):
 
         return self.df
 
+    def getData(self):
+        '''
+        返回数据，首次调用时才读取文件
+        '''
+        if self.df is None:
+            self.retrieve()
+        return self.df
+
     def getIterator(self):
         '''
-        返回一个pandas迭代器
+        返回一个逐行输出(Timestamp, ndarray)的迭代器, dataframe输出一行数组, series输出标量
         '''
-        # 判断所读取的数据为dataframe还是series，相应地生成迭代器
-        self.iterator = self.df.iterrows() if len(
-            self.df.shape) == 2 else self.df.iteritems()
+        self.getData()
+        self.iterator = self.iterRows()
         return self.iterator
 
     def getDir(self):
@@ -470,20 +803,22 @@ class H5PanelReader(BasePanelReader):
         '''
         返回数据长度
         '''
-        return self.df.shape
+        return self.getData().shape
 
     def getDateRange(self):
         '''
-        返回数据起止日期
+        返回数据起止日期，未读取数据且没有起止时间限制时只读取文件的首尾两行
         '''
-        return (self.df.index[0], self.df.index[-1])
+        if self.df is None and self.start is None and self.end is None:
+            return readH5DateRange(self.dir)
+        return (self.getData().index[0], self.getData().index[-1])
 
     def getRegisteredInstruments(self):
         '''
         返回股票代码
         '''
         self.instrumentList = []
-        if len(self.df.shape) == 2:
+        if len(self.getData().shape) == 2:
             self.instrumentList = self.df.columns.values.tolist()
         return self.instrumentList
 
@@ -506,15 +841,13 @@ class H5PanelReader(BasePanelReader):
         '''
         直接将全量数据转换为静态的SequenceDataPanel或者SequenceDataSeries，返回对象
         '''
-        if len(self.df.shape) == 2:
-            self.staticPanel = series.SequenceDataPanel(
-                self.getRegisteredInstruments(), maxLen=maxLen, dtype=np.float32)
-            for index, row in self.df.iterrows():
-                self.staticPanel.appendWithDateTime(index, row)
+        if len(self.getData().shape) == 2:
+            self.staticPanel = series.SequenceDataPanel.from_array(
+                self.df.values, self.df.index, self.getRegisteredInstruments(), maxLen=maxLen, dtype=np.float32)
             return self.staticPanel
         else:
             self.staticSeries = series.SequenceDataSeries(maxLen=maxLen)
-            for index, row in self.df.iteritems():
+            for index, row in self.df.items():
                 self.staticSeries.appendWithDateTime(index, row)
             return self.staticSeries
 
@@ -531,13 +864,16 @@ class H5BatchPanelReader(BasePanelReader):
     '''
     logger = logger.getLogger("H5PanelReader")
 
-    def __init__(self, factorName=None, frequency=None, start=None, end=None):
+    TIMESTAMPED_FILE = re.compile(r'^(.*)_\d{8}_\d{4}\.h5$')
+
+    def __init__(self, factorName=None, frequency=None, start=None, end=None, workers=1):
         '''
         初始化
         param path: 文件夹路径
         param frequency: 数据频率
         param start: 所需要获取的数据开始时间
         param end: 所需要获取的数据结束时间
+        param workers: loadAll时并行读取文件的进程数
         '''
         super().__init__()
         self.frequency = frequency
@@ -552,6 +888,7 @@ class H5BatchPanelReader(BasePanelReader):
         self.isEof = False
         self.availFctList = None
         self.factorName = factorName
+        self.workers = workers
         self.setFilePath()
 
     def setFilePath(self):
@@ -568,7 +905,8 @@ class H5BatchPanelReader(BasePanelReader):
 
     def prepareOutputData(self):
         '''
-        获取数据，生成dataframe，并将文件名及对应的路径、reader对象、和dataframe存入相应的字典
+        查找文件，将文件名及对应的路径、reader对象存入相应的字典
+        同一序列有多个时间戳版本时只保留最新的文件，数据在首次使用时才读取
         '''
 
         # 判断路径下是否有子文件夹，有的话将所有子文件夹的路径存入一个list
@@ -577,46 +915,60 @@ class H5BatchPanelReader(BasePanelReader):
         print(folderNameList)
         # 判断folderNameList是否有值，若有，说明包含子文件夹，则读取所有resample文件夹
         if folderNameList:
-            # 将上述子文件夹生成全路径后，存入list
-            folderDirList = [
-                os.path.join(
-                    self.path,
-                    folderName) for folderName in folderNameList]
-            # 遍历每个resample文件夹
-            for folderDir in folderDirList:
-                # 获取每个因子文件夹下的所有h5文件
-                fileNameList = [name for name in os.listdir(folderDir) if ".h5" in name]
-                # fileNameList = os.listdir(folderDir)
-                # 将上述h5文件生成全路径后，存入list
-                filePathList = [
-                    os.path.join(
-                        folderDir,
-                        fileName) for fileName in fileNameList]
-                # 遍历单个resample文件夹下的所有h5文件
-                for fileName, filePath in zip(fileNameList, filePathList):
-                    # 将文件名及文件全路径存入相应字典
-                    self.filePathDict[fileName] = filePath
-                    # 将文件名及reader对象存入相应字典
-                    self.readerDict[fileName] = H5PanelReader(
-                        filePath, self.frequency, self.start, self.end)
-                    # 将文件名及所读取的dataframe存入相应字典
-                    self.testResultDict[fileName] = self.readerDict[fileName].retrieve(
-                    )
-
+            for folderName in folderNameList:
+                self.addFolder(os.path.join(self.path, folderName))
         # 若folderNameList为空，说明路径下没有子文件夹，则读取单个resample文件夹
         else:
-            # 获取所需因子文件夹下的所有h5文件
-            fileNameList = [name for name in os.listdir(self.path) if ".h5" in name]
-            # fileNameList = os.listdir(self.path)
-            # 将上述h5文件生成全路径后，存入list
-            filePathList = [os.path.join(self.path, fileName)
-                            for fileName in fileNameList]
-            for fileName, filePath in zip(fileNameList, filePathList):
-                self.filePathDict[fileName] = filePath
-                self.readerDict[fileName] = H5PanelReader(
-                    filePath, self.frequency, self.start, self.end)
-                self.testResultDict[fileName] = self.readerDict[fileName].retrieve(
-                )
+            self.addFolder(self.path)
+
+    def addFolder(self, folderDir):
+        '''
+        将文件夹下每个序列最新的h5文件生成reader对象，并存入相应字典
+        :param folderDir: 文件夹路径
+        '''
+        fileNameList = self.selectLatestFiles([name for name in os.listdir(folderDir) if ".h5" in name])
+        for fileName in fileNameList:
+            filePath = os.path.join(folderDir, fileName)
+            # 将文件名及文件全路径存入相应字典
+            self.filePathDict[fileName] = filePath
+            # 将文件名及reader对象存入相应字典
+            self.readerDict[fileName] = H5PanelReader(filePath, self.frequency, self.start, self.end)
+
+    def selectLatestFiles(self, fileNameList):
+        '''
+        :param fileNameList: 文件名列表，文件名格式为 序列名_%Y%m%d_%H%M.h5
+        :return: 每个序列名只保留时间戳最新的文件，不符合该格式的文件全部保留
+        '''
+        latest = {}
+        for fileName in sorted(fileNameList):
+            match = self.TIMESTAMPED_FILE.match(fileName)
+            latest[match.group(1) if match else fileName] = fileName  # 排序后后出现的时间戳更新
+        return sorted(latest.values())
+
+    def loadAll(self, workers=None):
+        '''
+        读取所有尚未读取的文件，并将所读取的dataframe存入testResultDict
+        :param workers: 并行读取的进程数，None则使用初始化时的设置，1则在当前进程中顺序读取
+        '''
+        workers = self.workers if workers is None else workers
+        toLoad = [fileName for fileName, reader in self.readerDict.items() if reader.df is None]
+        if workers != 1 and len(toLoad) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                dfs = list(executor.map(readH5File, [self.filePathDict[fileName] for fileName in toLoad]))
+        else:
+            dfs = [None] * len(toLoad)
+        for fileName, df in zip(toLoad, dfs):
+            self.readerDict[fileName].retrieve(df)
+        for fileName, reader in self.readerDict.items():
+            self.testResultDict[fileName] = reader.df
+
+    def getResult(self, fileName):
+        '''
+        返回单个文件的dataframe，首次调用时才读取
+        '''
+        if fileName not in self.testResultDict:
+            self.testResultDict[fileName] = self.readerDict[fileName].getData()
+        return self.testResultDict[fileName]
 
     def getDir(self):
         '''
@@ -638,8 +990,9 @@ class H5BatchPanelReader(BasePanelReader):
 
     def getTestResult(self):
         '''
-        返回存储检测数据dataframe的字典
+        返回存储检测数据dataframe的字典，尚未读取的文件此时一并读取
         '''
+        self.loadAll()
         return self.testResultDict
 
     def getReader(self):
@@ -7,6 +7,9 @@
 import os
 import datetime
 
+import numpy as np
+import pandas as pd
+
 from cpa.io import BaseWriter
 from cpa.config import pathSelector
 from cpa.utils import logger
@@ -14,6 +17,93 @@ from cpa.config import const
 from cpa.factorProcessor import factorTest
 
 
+class H5PanelSink(BaseWriter):
+    '''
+    SequenceDataPanel的流式写入接口
+    说明：订阅panel的新值事件，缓存chunkSize行后追加写入h5 table，运行期间内存占用固定，不受panel的maxLen限制。
+         最新一行始终保留在缓存中，以便接收updateValuesEvent对最新一行的修改。运行结束后需调用close()写入剩余数据。
+    '''
+
+    logger = logger.getLogger("H5PanelSink")
+
+    def __init__(self, panel, filePath, key, chunkSize=1024, mode="w"):
+        '''
+        初始化
+        param panel: 需要写入的SequenceDataPanel，如FactorPanel
+        param filePath: h5文件路径
+        param key: h5文件中table的key
+        param chunkSize: 每次写入的行数
+        param mode: "w"删除已有文件后重新写入，"a"在已有table后追加
+        '''
+        self.panel = panel
+        self.filePath = filePath
+        self.key = key
+        self.chunkSize = chunkSize
+        self.columns = [str(col) for col in panel.getColumnNames()]
+        self.dateTimes = np.empty(chunkSize + 1, dtype="datetime64[ns]")
+        self.values = np.empty((chunkSize + 1, len(self.columns)), dtype=panel.getDtype())
+        self.count = 0  # 缓存中的行数
+        self.writtenRows = 0  # 已写入文件的行数
+        if mode == "w" and os.path.exists(filePath):
+            os.remove(filePath)
+
+        panel.getNewValuesEvent().subscribe(self.onNewValues)
+        panel.getUpdateValuesEvent().subscribe(self.onUpdateValues)
+
+    def getDir(self):
+        return self.filePath
+
+    def onNewValues(self, panel, dateTime, values):
+        if self.count == len(self.values):  # 缓存已满，写入除最新一行以外的数据
+            self.flush(keepLast=True)
+        self.dateTimes[self.count] = np.datetime64(dateTime, "ns")
+        self.values[self.count] = values
+        self.count += 1
+
+    def onUpdateValues(self, panel, dateTime, values):
+        if self.count == 0:
+            self.logger.warning("The row {} has been written, the update is ignored".format(dateTime))
+            return
+        self.dateTimes[self.count - 1] = np.datetime64(dateTime, "ns")
+        self.values[self.count - 1] = values
+
+    def flush(self, keepLast=False):
+        '''
+        将缓存中的数据追加写入h5文件
+        param keepLast: 是否保留最新一行在缓存中
+        '''
+        rows = self.count - 1 if keepLast else self.count
+        if rows <= 0:
+            return
+        df = pd.DataFrame(self.values[:rows], index=pd.DatetimeIndex(self.dateTimes[:rows]), columns=self.columns)
+        with pd.HDFStore(self.filePath, mode="a") as store:
+            # 逐块写入时不建索引, close()时统一建立一次
+            store.append(self.key, df, format="table", data_columns=True, index=False)
+        self.writtenRows += rows
+        # 未写入的行移到缓存开头
+        self.dateTimes[:self.count - rows] = self.dateTimes[rows:self.count]
+        self.values[:self.count - rows] = self.values[rows:self.count]
+        self.count -= rows
+        self.logger.debug("{} rows have been written to {}".format(self.writtenRows, self.filePath))
+
+    def write(self, filePath=None, mode="a"):
+        '''
+        写入缓存中的全部数据
+        '''
+        self.flush()
+
+    def close(self):
+        '''
+        写入剩余数据并建立table索引，取消对panel事件的订阅
+        '''
+        self.flush()
+        if self.writtenRows > 0 and os.path.exists(self.filePath):
+            with pd.HDFStore(self.filePath, mode="a") as store:
+                store.create_table_index(self.key)
+        self.panel.getNewValuesEvent().unsubscribe(self.onNewValues)
+        self.panel.getUpdateValuesEvent().unsubscribe(self.onUpdateValues)
+
+
 class H5PanelWriter(BaseWriter):
     '''
     因子计算及检测数据h5文件写入接口
@@ -24,11 +114,13 @@ class H5PanelWriter(BaseWriter):
 
     logger = logger.getLogger("H5PanelWriter")
 
-    def __init__(self, defaultFactorTest, factorName):
+    def __init__(self, defaultFactorTest, factorName, factorSink=None):
         '''
         初始化
         param defaultFactorTest: factorTest.py下的DefaultFactorTest类对象
         param factorName: 因子名
+        param factorSink: 运行期间写入因子值的H5PanelSink，"new"模式下直接使用其文件，"append"模式下读取其文件追加，
+                          均不再从factorPanel.to_frame()写入，不受factorPanel的maxLen限制
         '''
         self.defaultFactorTest = defaultFactorTest
         self.testReportGenerator = factorTest.TestReportGenerator(defaultFactorTest=self.defaultFactorTest,
@@ -44,6 +136,7 @@ class H5PanelWriter(BaseWriter):
 
         self.frequency = defaultFactorTest.frequency
         self.factorName = factorName
+        self.factorSink = factorSink
         self.count = 0
         self.name = self.__class__.__name__
 
@@ -53,11 +146,96 @@ class H5PanelWriter(BaseWriter):
         '''
         pass
 
+    def getStoredFilePath(self, folder, prefix):
+        '''
+        查找已存储的h5文件
+        param folder: 因子文件夹路径
+        param prefix: 文件名前缀，如 factorName_IC_1min_
+        return: 该前缀下时间戳最新的文件路径，没有则返回None
+        '''
+        fileNameList = sorted(name for name in os.listdir(folder) if name.startswith(prefix) and name.endswith(".h5"))
+        return os.path.join(folder, fileNameList[-1]) if fileNameList else None
+
+    def getStoredRange(self, filePath):
+        '''
+        只读取table的首尾两行，获取已存储数据的起止时间，不加载整个文件
+        param filePath: h5文件路径
+        return: (key, 起始时间, 截止时间)
+        '''
+        with pd.HDFStore(filePath, mode="r") as store:
+            key = store.keys()[0]
+            nrows = store.get_storer(key).nrows
+            first = store.select(key, start=0, stop=1).index[0]
+            last = store.select(key, start=nrows - 1, stop=nrows).index[0]
+        return key, first, last
+
+    def appendFile(self, data, oldFilePath, newFilePath):
+        '''
+        将data中晚于已存储截止时间的行追加写入旧文件的table，并把文件重命名为本次写入的文件名
+        param data: 新生成的dataframe或series
+        param oldFilePath: 已存储的h5文件路径
+        param newFilePath: 本次写入的文件路径
+        return: 是否写入
+        '''
+        key, first, last = self.getStoredRange(oldFilePath)
+        # 当新data的最早时间晚于旧data的最早时间并早于旧data的最晚时间才进行拼接，时间重复的数据保留旧值
+        if not (first < data.index[0] < last):
+            return False
+        newData = data[data.index > last]
+        if len(newData):
+            with pd.HDFStore(oldFilePath, mode="a") as store:
+                stored = store.select(key, start=0, stop=0)  # 空表，只用于获取已存储的列和dtype
+                newData = newData.set_axis(newData.index.astype(stored.index.dtype), axis=0)  # 时间精度与已存储的一致
+                if isinstance(newData, pd.DataFrame):
+                    # 股票池变化后新data的列与已存储的列不一致，table只能追加列和dtype完全相同的数据
+                    if set(newData.columns) <= set(stored.columns):
+                        newData = newData.reindex(columns=stored.columns).astype(stored.dtypes)
+                    else:
+                        newData = None  # 出现新的股票，需要整体重写
+                else:
+                    newData = newData.astype(stored.dtype)
+                if newData is not None:
+                    store.append(key, newData, format="table", data_columns=True)
+            if newData is None:
+                self.rewriteFile(key, data[data.index > last], oldFilePath)
+        if oldFilePath != newFilePath:
+            os.replace(oldFilePath, newFilePath)
+        return True
+
+    def rewriteFile(self, key, newData, filePath):
+        '''
+        读取已存储的数据，与新data按列对齐拼接后重写，先写入临时文件再替换，写入失败时不影响旧文件
+        param key: h5文件中table的key
+        param newData: 晚于已存储截止时间的新data
+        param filePath: 已存储的h5文件路径
+        '''
+        oldData = pd.read_hdf(filePath, key=key)
+        tmpPath = filePath + ".tmp"
+        pd.concat([oldData, newData], axis=0).to_hdf(path_or_buf=tmpPath, key=key, format="table",
+                                                     data_columns=True, mode="w")
+        os.replace(tmpPath, filePath)
+        self.logger.info("The columns of {} have changed, the file has been rewritten".format(os.path.basename(filePath)))
+
+    def getSinkData(self):
+        '''
+        写入sink的剩余数据后读取其临时文件的全部因子值，读取后删除临时文件
+        return: 因子值dataframe，没有sink或sink未写入任何数据时返回None
+        '''
+        if self.factorSink is None:
+            return None
+        self.factorSink.close()
+        sinkPath = self.factorSink.getDir()
+        if not os.path.exists(sinkPath):
+            return None
+        data = pd.read_hdf(sinkPath, key=self.factorSink.key)
+        os.remove(sinkPath)
+        return data
+
     def write(self, mode, oldResultDict=None):
         '''
         写入函数
         param mode: 写入模式， "new" or "append"
-        param oldResultDict: 存储旧h5文件数据的字典，由h5PanelReader生成
+        param oldResultDict: 已不再使用，append模式直接在已存储的文件末尾追加，保留该参数以兼容旧的调用
         '''
         # 存储路径命名
         currentDT = datetime.datetime.now()
@@ -73,11 +251,16 @@ class H5PanelWriter(BaseWriter):
         # 写入新h5文件
         if mode == "new":
             # 因子计算数据存储
-            self.testReportGenerator.defaultFactorTest.factorPanel.to_frame().to_hdf(path_or_buf=calFilePath,  # 使用pandas存储h5文件
-                                                                 key=self.factorName,
-                                                                 format="table",
-                                                                 data_columns=True,
-                                                                 mode="w")
+            if self.factorSink is not None:  # 因子值已在运行期间写入，写入剩余数据后重命名
+                self.factorSink.close()
+            if self.factorSink is not None and os.path.exists(self.factorSink.getDir()):
+                os.replace(self.factorSink.getDir(), calFilePath)
+            else:  # 没有sink或sink未写入任何数据时, 仍从factorPanel写入
+                self.testReportGenerator.defaultFactorTest.factorPanel.to_frame().to_hdf(path_or_buf=calFilePath,  # 使用pandas存储h5文件
+                                                                     key=self.factorName,
+                                                                     format="table",
+                                                                     data_columns=True,
+                                                                     mode="w")
             self.logger.info("The file {} has been saved".format(calFileName))
 
             # 因子检测数据存储
@@ -123,55 +306,39 @@ class H5PanelWriter(BaseWriter):
 
         # 续写h5文件
         elif mode == "append":
+            freqLable = const.DataFrequency.freq2lable(self.frequency)
             # 因子计算数据存储
-            for key in oldResultDict.keys():
-                if "factor" in key:
-                    oldCalFileName = key
-            appendDataFrame = self.testReportGenerator.defaultFactorTest.factorPanel.to_frame()  # 新生成的因子计算值dataframe
-            # 当新dataframe的最早时间晚于旧dataframe的最早时间并早于旧dataframe的最晚时间才进行拼接
-            if appendDataFrame.index[0] > oldResultDict[oldCalFileName].index[0] \
-                    and appendDataFrame.index[0] < oldResultDict[oldCalFileName].index[-1]:
-                newDataFrame = oldResultDict[oldCalFileName].append(appendDataFrame)
-                newDataFrame = newDataFrame.loc[~newDataFrame.index.duplicated(keep="first")]  # 删除时间重复的数据
-                newDataFrame.to_hdf(path_or_buf=calFilePath,  # 使用pandas存储h5文件
-                                    key=self.factorName,
-                                    format="table",
-                                    data_columns=True,
-                                    mode="w")
+            appendDataFrame = self.getSinkData()  # 新生成的因子计算值dataframe
+            if appendDataFrame is None:
+                appendDataFrame = self.testReportGenerator.defaultFactorTest.factorPanel.to_frame()
+            oldCalFilePath = self.getStoredFilePath(factorFolderPath, self.factorName + "_factor_" + freqLable + "_")
+            if oldCalFilePath is None:
+                self.logger.info("No stored factor file of {} is found. The new dataframe will not be appended.".format(self.factorName))
+            elif self.appendFile(appendDataFrame, oldCalFilePath, calFilePath):
                 self.count += 1
                 self.logger.info("The file {} has been saved".format(calFileName))
             else:
-                self.logger.info("The earliest time of {} is before the one of {}. "
-                                 "The new dataframe will not be appended.".format(calFileName, oldCalFileName))
+                self.logger.info("The earliest time of {} is not within the range of {}. "
+                                 "The new dataframe will not be appended.".format(calFileName, os.path.basename(oldCalFilePath)))
 
             # 因子检测数据存储
             indicatorDict = self.testReportGenerator.defaultFactorTest.getIndicators()
             for key, value in indicatorDict.items():  # 遍历新生成的检测数据
-                testFileName = self.factorName + "_" + key + "_" +\
-                               const.DataFrequency.freq2lable(self.frequency) +\
+                testFileName = self.factorName + "_" + key + "_" + freqLable +\
                                currentDT.strftime("_%Y%m%d_%H%M") + ".h5" # 命名因子检测数据文件
                 testFilePath = os.path.join(factorFolderPath, testFileName)
                 if indicatorDict[key].__len__():  # 当存储因子检测值不为空时进行存储
                     appendData = value.to_frame() if key in ['groupRet', 'IC', 'rankIC', 'turn', 'cost', 'groupNumber']\
                                     else value.to_series()  # 生成新因子检测值df或者series
-                    for key, value in oldResultDict.items():  # 提取存放旧h5数据的字典
-                        # 检测新因子文件名是否与旧因子文件名相同
-                        if "".join(testFileName.split("_")[0:2]) == "".join(key.split("_")[0:2]):
-                            # 当新data的最早时间晚于旧data的最早时间并早于旧data的最晚时间才进行拼接
-                            if appendData.index[0] > oldResultDict[key].index[0] \
-                                    and appendData.index[0] < oldResultDict[key].index[-1]:
-                                newData = oldResultDict[key].append(appendData)
-                                newData = newData.loc[~newData.index.duplicated(keep="first")]
-                                newData.to_hdf(path_or_buf=testFilePath,
-                                                 key=key,
-                                                 format="table",
-                                                 data_columns=True,
-                                                 mode="w")
-                                self.count += 1
-                                self.logger.info("The file {} has been saved".format(testFileName))
-                            else:
-                                self.logger.info("The earliest time of {} is before the one of {}. "
-                                                 "The new series will not be appended.".format(testFileName, key))
+                    oldTestFilePath = self.getStoredFilePath(factorFolderPath, self.factorName + "_" + key + "_" + freqLable + "_")
+                    if oldTestFilePath is None:
+                        self.logger.info("No stored file of {} is found. The new series will not be appended.".format(key))
+                    elif self.appendFile(appendData, oldTestFilePath, testFilePath):
+                        self.count += 1
+                        self.logger.info("The file {} has been saved".format(testFileName))
+                    else:
+                        self.logger.info("The earliest time of {} is not within the range of {}. "
+                                         "The new series will not be appended.".format(testFileName, os.path.basename(oldTestFilePath)))
 
                 else:  # 当存储因子检测值的series为空时，不进行存储，并记入日志
                     self.logger.info("The calculation of {} failed".format(key))
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+'''
+列式存储的分钟数据, 由月度h5数据转换而来
+目录结构为 year/month/field.npy, 每个月另有datetime.npy和instruments.npy两个索引文件
+读取时使用内存映射, 不需要解压和解码, 多个进程通过系统页缓存共享同一份数据
+'''
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from cpa.io.h5Reader import H5DataReader, readH5Columns, toMinuteIndex, roundField, fieldDtype
+from cpa.config import pathSelector, const
+from cpa.utils import bar
+from cpa.utils import logger
+from cpa.config.pathSelector import platformSectionSelector
+
+TIMELINE_FILE = 'datetime.npy'
+INSTRUMENT_FILE = 'instruments.npy'
+START_END_FILE = 'start_end_date.pickle'
+INDEX_CONSTITUENT_FILE = 'indexconstituent.pickle'
+
+
+def saveArray(path, values):
+    '''
+    先写临时文件再替换, 避免读取到写了一半的文件
+    :param path: npy文件路径
+    :param values: 要保存的数组
+    '''
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        np.save(f, values)
+    os.replace(tmpPath, path)
+
+
+def getMonthDir(folder, date):
+    '''
+    :param folder: 数据的总文件夹路径
+    :param date: 月份
+    :return: 该月数据所在的文件夹, 如 folder/2015/6
+    '''
+    return os.path.join(folder, str(date)[0:4], str(int(str(date)[5:7])))
+
+
+def listMonths(folder):
+    '''
+    :param folder: 按 year/month 存放数据的文件夹
+    :return: 文件夹中全部月份的月初日期, 升序排列
+    '''
+    months = []
+    for year in os.listdir(folder):
+        yearDir = os.path.join(folder, year)
+        if not (year.isdigit() and os.path.isdir(yearDir)):
+            continue
+        for month in os.listdir(yearDir):
+            if month.isdigit() and os.path.isdir(os.path.join(yearDir, month)):
+                months.append(pd.Timestamp(int(year), int(month), 1))
+    return sorted(months)
+
+
+class NpyDataConverter:
+    '''
+    将H5DataReader使用的月度h5数据转换为列式的npy存储
+    每个字段每个月保存为一个 时间 × 股票 的数组, 价格字段为float32, 其余字段为float64, 同月各字段的行列对齐
+    '''
+    logger = logger.getLogger("NpyDataConverter")
+
+    def __init__(self, srcPath, dstPath, fields=None):
+        '''
+        :param srcPath: 月度h5数据的文件夹
+        :param dstPath: npy存储的文件夹
+        :param fields: 需要转换的字段, None则转换每个月文件夹中的全部h5文件
+        '''
+        self.srcPath = srcPath
+        self.dstPath = dstPath
+        self.fields = fields
+
+    def getFields(self, srcDir):
+        if self.fields is not None:
+            return self.fields
+        return sorted(name[:-3] for name in os.listdir(srcDir) if name.endswith('.h5'))
+
+    def isConverted(self, srcDir, dstDir, fields):
+        '''
+        :return: 目标月份已转换且晚于全部源文件时返回True, datetime.npy最后写入, 转换中断的月份会重新转换
+        '''
+        timeLinePath = os.path.join(dstDir, TIMELINE_FILE)
+        if not os.path.exists(timeLinePath):
+            return False
+        if not all(os.path.exists(os.path.join(dstDir, field + '.npy')) for field in fields):
+            return False
+        converted = os.path.getmtime(timeLinePath)
+        return all(os.path.getmtime(os.path.join(srcDir, field + '.h5')) <= converted for field in fields)
+
+    def readField(self, srcDir, field):
+        '''
+        :return: 与H5DataReader.fileterH5File相同处理后的dataframe, 重复的时间只保留第一条
+        '''
+        df = readH5Columns(os.path.join(srcDir, field + '.h5'))
+        if "xuefu" not in platformSectionSelector():
+            df.index = toMinuteIndex(df.index)
+        df = roundField(df, field)
+        return df[~df.index.duplicated(keep='first')]
+
+    def convertMonth(self, date, force=False):
+        '''
+        转换一个月的数据
+        :param date: 月份
+        :param force: 为True时忽略已有的转换结果
+        :return: 是否进行了转换
+        '''
+        srcDir = getMonthDir(self.srcPath, date)
+        dstDir = getMonthDir(self.dstPath, date)
+        fields = self.getFields(srcDir)
+        if not force and self.isConverted(srcDir, dstDir, fields):
+            self.logger.debug("{} already converted.".format(dstDir))
+            return False
+
+        frames = {field: self.readField(srcDir, field) for field in fields}
+        timeLine = np.unique(np.concatenate([frame.index.values for frame in frames.values()]))
+        columns = sorted(set().union(*[frame.columns for frame in frames.values()]))
+
+        os.makedirs(dstDir, exist_ok=True)
+        for field, frame in frames.items():
+            values = frame.reindex(index=timeLine, columns=columns).values.astype(fieldDtype(field))
+            saveArray(os.path.join(dstDir, field + '.npy'), values)
+        saveArray(os.path.join(dstDir, INSTRUMENT_FILE), np.array(columns, dtype=str))
+        saveArray(os.path.join(dstDir, TIMELINE_FILE), timeLine.astype('datetime64[ns]'))
+        self.logger.info("{} converted, {} fields.".format(dstDir, len(fields)))
+        return True
+
+    def convertInfo(self):
+        '''
+        转换上市退市表, 并复制指数成分股文件
+        '''
+        os.makedirs(self.dstPath, exist_ok=True)
+        startEnd = pd.read_excel(os.path.join(self.srcPath, 'start_end_date.xlsx'), dtype={'index': str})
+        startEnd.to_pickle(os.path.join(self.dstPath, START_END_FILE))
+        constituent = os.path.join(self.srcPath, INDEX_CONSTITUENT_FILE)
+        if os.path.exists(constituent):
+            shutil.copy2(constituent, os.path.join(self.dstPath, INDEX_CONSTITUENT_FILE))
+
+    def convert(self, start=None, end=None, force=False):
+        '''
+        转换start和end之间的全部月份, 已转换且源文件未更新的月份会被跳过
+        :param start: 起始月份, None则从最早的月份开始
+        :param end: 截止月份, None则到最后的月份
+        :param force: 为True时重新转换全部月份
+        :return: 本次转换的月份数
+        '''
+        self.convertInfo()
+        count = 0
+        for date in listMonths(self.srcPath):
+            if start is not None and date < pd.to_datetime(start).replace(day=1):
+                continue
+            if end is not None and date > pd.to_datetime(end):
+                continue
+            count += self.convertMonth(date, force)
+        return count
+
+
+class NpyDataStore:
+    '''
+    npy存储的读取接口, 提供与H5DataCatalog相同的getStartEnd和getMonth
+    数组均以只读的内存映射方式打开
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self):
+        pass  # 索引本身就是npy文件, 不需要额外的目录
+
+    def getStartEnd(self):
+        '''
+        :return: 股票上市、退市日期表
+        '''
+        return pd.read_pickle(os.path.join(self.path, START_END_FILE))
+
+    def getMonth(self, reader, date):
+        '''
+        :param reader: 调用方, 为了与H5DataCatalog的接口保持一致
+        :param date: 月份
+        :return: {'timeLine': 当月排序后的交易时间(datetime64), 'columns': 当月全部股票代码}
+        '''
+        monthDir = getMonthDir(self.path, date)
+        return {'timeLine': np.load(os.path.join(monthDir, TIMELINE_FILE), mmap_mode='r'),
+                'columns': np.load(os.path.join(monthDir, INSTRUMENT_FILE)).tolist()}
+
+    def getField(self, date, field):
+        '''
+        :return: 当月某个字段的 时间 × 股票 数组, 只读内存映射
+        '''
+        return np.load(os.path.join(getMonthDir(self.path, date), field + '.npy'), mmap_mode='r')
+
+
+class NpyMonthBlock:
+    '''
+    一个月的数据视图, 按时间下标取出 field × instrument 数组
+    数据留在内存映射中, 每次只把需要的一行拷贝进预先分配的缓存, 不再为每个bar分配数组,
+    返回的数组在下一次取值时会被覆盖, 需要保留时应copy
+    '''
+
+    def __init__(self, fieldArrays, rows, source, target, nInstruments, timeLine=None, endDates=None):
+        '''
+        :param fieldArrays: 各字段的 时间 × 股票 内存映射数组
+        :param rows: 输出的各个时间在文件中的行号
+        :param source: 文件中需要读取的列
+        :param target: source中各列对应的registeredInstruments下标
+        :param nInstruments: registeredInstruments的数量
+        :param timeLine: 输出的时间, 与endDates一起用于把已退市的股票置为nan
+        :param endDates: 与registeredInstruments对齐的退市日期, None则不处理退市
+        '''
+        self.fieldArrays = fieldArrays
+        self.rows = rows
+        self.source = source
+        self.target = target
+        self.nInstruments = nInstruments
+        self.timeLine = timeLine
+        self.endDates = endDates
+        # 文件中的列与registeredInstruments完全一致时直接按行切片
+        self.aligned = len(source) == nInstruments and len(fieldArrays) > 0 \
+            and fieldArrays[0].shape[1] == nInstruments and np.array_equal(source, target)
+        dtype = np.result_type(*[fieldArray.dtype for fieldArray in fieldArrays]) if fieldArrays else np.float32
+        # 不在文件中的列始终为nan, 每个bar只覆盖target列
+        self.buffer = np.full((len(fieldArrays), nInstruments), np.nan, dtype=dtype)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        row = self.rows[idx]
+        values = self.buffer
+        for i, fieldArray in enumerate(self.fieldArrays):
+            if self.aligned:
+                values[i] = fieldArray[row]
+            else:
+                values[i, self.target] = fieldArray[row, self.source]
+        if self.endDates is not None:
+            values[:, ~(self.timeLine[idx] < self.endDates)] = np.nan  # 该时间已经退市或退市日期缺失的股票置为nan
+        return values
+
+
+class NpyDataReader(H5DataReader):
+    '''
+    npy列式存储的feed数据读取接口, 输出与H5DataReader一致
+    数据以内存映射方式打开, 不再整月解码, 重复回测时直接使用系统页缓存
+    '''
+
+    logger = logger.getLogger("NpyDataReader")
+
+    def __init__(
+            self,
+            frequency=bar.Frequency.MINUTE,
+            instruments=None,
+            fields=None,
+            start=None,
+            end=None,
+            limit=-1,
+            path=None):
+        '''
+        :param frequency: 数据周期
+        :param instruments: 所选股票code
+        :param fields: 所选字段,高开低收等
+        :param startTime: 起始时间
+        :param path: npy存储的文件夹, None则使用h5数据路径加'_npy'后缀
+        '''
+        self.storePath = path
+        super().__init__(frequency, instruments, fields, start, end, limit)
+
+    def setFilePath(self, path=None):
+        '''
+        设置npy存储的文件夹路径
+        '''
+        if path is None:
+            path = self.storePath
+        if path is None:
+            path = pathSelector.PathSelector.getDataFilePath(
+                const.DataMarket.STOCK,
+                const.DataType.OHLCV,
+                const.DataFrequency.freq2lable(
+                    self.frequency)).rstrip('/\\') + '_npy'
+        self.path = path
+        self.catalog = NpyDataStore(self.path)
+        self.startEnd = self.catalog.getStartEnd()
+        self.indexConstituent = None
+        self.totalLength = self.getTotalLength()
+
+    def openMonth(self, date, month):
+        '''
+        打开一个月的数据
+        :param date: 月份
+        :param month: self.catalog.getMonth的返回值
+        :return: timeLine(start和end之间的datetime64), NpyMonthBlock
+        '''
+        timeLine = month['timeLine']
+        rows = np.flatnonzero((timeLine >= np.datetime64(self.start)) & (timeLine <= np.datetime64(self.end)))
+        timeLine = np.asarray(timeLine[rows])
+        fieldArrays = [self.catalog.getField(date, field) for field in self.fields]
+        source, target = self.getColumnMap(pd.Index(month['columns']))
+        endDates = None if self.isIndexUniverse() else self.getEndDates()
+        block = NpyMonthBlock(fieldArrays, rows, source, target, len(self.registeredInstruments), timeLine, endDates)
+        return timeLine, block
+
+    def prepareOutputData(self):
+        '''
+        准备数据，打开下一个月的内存映射数组存进self.monthBlock
+        '''
+        if self.initialSignal == 0 and self.isIndexUniverse():
+            self.registeredInstruments = self.setRegisteredInstruments()
+            self.initialSignal = 1
+            self.currentInstruments = self.registeredInstruments
+
+        date = self.appliedTimeLine[0]
+        month = self.catalog.getMonth(self, date)
+        self.appliedTimeLine.pop(0)
+
+        if self.initialSignal == 0:
+            listed = set(self.startEnd['index'])
+            if self.instruments is not None:
+                wanted = set(self.instruments)
+                tmp = [col for col in month['columns'] if col in listed and col in wanted]  # 把市场中没有的股票代码统一去除
+            else:
+                tmp = [j for j in (self.registeredInstruments) if j in listed]
+            beforeDelisted = list(self.startEnd[(self.startEnd['end_date'] >= self.actualStart)]['index'])
+            afterlisted = list(self.startEnd[(self.startEnd['start_date'] <= self.actualEnd)]['index'])
+            self.registeredInstruments = sorted([j for j in tmp if (j in beforeDelisted) & (j in afterlisted)])
+            self.initialSignal = 1
+            self.currentInstruments = self.registeredInstruments
+
+        self.currentTimeLine, self.monthBlock = self.openMonth(date, month)
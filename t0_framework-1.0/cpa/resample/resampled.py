@@ -63,6 +63,8 @@ class PanelGrouper:
 class ResampledPanelFeed(baseFeed.PanelFeed):
     """
     market is in cpa.resamplebase.Market.STOCK or cpa.resamplebase.Market.CTP
+    只对OHLCV重采样; 所有字段共用一个数据块, 额外字段(如amount)与K线对齐, 每根重采样K线写入一行nan,
+    价格为float32, 成交量和额外字段为float64, 与PanelFeed一致
     """
     logger = logger.getLogger('resampleFeed')
     def __init__(self,panelFeed, frequency, marketType=bar.Market.STOCK, maxLen=None):
@@ -149,11 +151,7 @@ class ResampledPanelFeed(baseFeed.PanelFeed):
     def appendWithDateTime(self, dateTime, grouped):
         self.__currentDateTime = dateTime
         groupedTime, grouped = grouped
-        self.openPanel.appendWithDateTime(groupedTime, grouped['open'])
-        self.highPanel.appendWithDateTime(groupedTime, grouped['high'])
-        self.lowPanel.appendWithDateTime(groupedTime, grouped['low'])
-        self.closePanel.appendWithDateTime(groupedTime, grouped['close'])
-        self.volumePanel.appendWithDateTime(groupedTime, grouped['volume'])
+        self.panelBlock.appendWithDateTime(groupedTime, self.panelBlock.toArray(grouped))
         self.dispatchNewValueEvent(self, dateTime, None)
         self.logger.debug('ResampledTime %s: %s'.format(const.DataFrequency.freq2lable(self.frequency),
                                                         groupedTime.strftime('%Y-%m-%d %H:%M:%S')))
@@ -161,11 +159,7 @@ class ResampledPanelFeed(baseFeed.PanelFeed):
     def updateWithDateTime(self, dateTime, grouped):
         self.__currentDateTime = dateTime
         groupedTime, grouped = grouped
-        self.openPanel.updateWithDateTime(groupedTime, grouped['open'])
-        self.highPanel.updateWithDateTime(groupedTime, grouped['high'])
-        self.lowPanel.updateWithDateTime(groupedTime, grouped['low'])
-        self.closePanel.updateWithDateTime(groupedTime, grouped['close'])
-        self.volumePanel.updateWithDateTime(groupedTime, grouped['volume'])
+        self.panelBlock.updateWithDateTime(groupedTime, self.panelBlock.toArray(grouped))
 
     def getCurrentDatetime(self):
         return self.__currentDateTime
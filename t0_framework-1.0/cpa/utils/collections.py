@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 from pyalgotrade import observer
 # Like a collections.deque but using a numpy.array.
 class NumPyDeque(object):
@@ -109,18 +110,115 @@ class ListDeque(object):
         """
         return [i + value for i in self.__values]
 
+class NumpyDateTimeDeque(object):
+    '''
+    datetime64[ns]时间戳队列, 接口与ListDeque一致, 用于替代SequenceDataPanel中的ListDeque
+    与NumpyPanelDeque相同使用双倍长度的镜像缓冲区, append不产生新对象, data()返回连续的datetime64视图
+    整数索引返回pd.Timestamp, 切片返回datetime64数组
+    '''
+    def __init__(self, maxLen):
+        assert maxLen > 0, "Invalid maximum length"
+        self.__values = np.empty(maxLen * 2, dtype='datetime64[ns]')
+        self.__maxLen = maxLen
+        self.__nextPos = [0, 0]  # [有效长度, 起始位置]
+
+    def getMaxLen(self):
+        return self.__maxLen
+
+    def append(self, value):
+        if self.__nextPos[0] < self.__maxLen:
+            # removeLast之后起始位置可能不为0, 写入位置为start + length, 同时写入镜像位置
+            pos = self.__nextPos[1] + self.__nextPos[0]
+            self.__values[pos] = value
+            self.__values[pos - self.__maxLen if pos >= self.__maxLen else pos + self.__maxLen] = value
+            self.__nextPos[0] += 1
+        else:
+            start = self.__nextPos[1]
+            self.__values[start + self.__maxLen] = value
+            self.__values[start] = value
+            start += 1
+            self.__nextPos[1] = 0 if start == self.__maxLen else start
+
+    def extend(self, values):
+        '''
+        :param values: datetime64数组, 一次性追加多个时间戳, 结果与逐个append相同
+        '''
+        values = np.asarray(values, dtype='datetime64[ns]')[-self.__maxLen:]
+        keep = min(self.__nextPos[0], self.__maxLen - len(values))
+        lastValues = self.data()[self.__nextPos[0] - keep:].copy()
+        self.__values[0:keep] = lastValues
+        self.__values[keep:keep + len(values)] = values
+        self.__nextPos[0] = keep + len(values)
+        self.__nextPos[1] = 0
+
+    def data(self):
+        start = self.__nextPos[1]
+        return self.__values[start:start + self.__nextPos[0]]
+
+    def asInt64(self):
+        '''
+        :return: 以int64(纳秒)视图返回时间戳, 不复制
+        '''
+        return self.data().view(np.int64)
+
+    def updateLast(self, value):
+        if self.__nextPos[0] == 0:
+            self.append(value)
+        else:
+            last = self.__nextPos[1] + self.__nextPos[0] - 1
+            self.__values[last] = value
+            self.__values[last - self.__maxLen if last >= self.__maxLen else last + self.__maxLen] = value
+
+    def removeLast(self):
+        if self.__nextPos[0] > 0:
+            self.__nextPos[0] -= 1
+
+    def resize(self, maxLen):
+        assert maxLen > 0, "Invalid maximum length"
+
+        values = np.empty(maxLen * 2, dtype='datetime64[ns]')
+        lastValues = self.data()[-maxLen:]
+        values[0:len(lastValues)] = lastValues
+        self.__values = values
+        self.__maxLen = maxLen
+        self.__nextPos = [len(lastValues), 0]
+
+    def __len__(self):
+        return self.__nextPos[0]
+
+    def __getitem__(self, key):
+        ret = self.data()[key]
+        if isinstance(ret, np.datetime64):
+            return pd.Timestamp(ret)
+        return ret
+
+    def __iter__(self):
+        return iter(pd.DatetimeIndex(self.data()))
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data() if dtype is None else self.data().astype(dtype)
+
 #row * col panel Deque
 class NumpyPanelDeque(object):
-    def __init__(self, rowLen, colLen, dtype=np.float32):
+    '''
+    mirrored=True时使用双倍长度的镜像环形缓冲区, 写满后每次append只写入两行(O(colLen)),
+    不再整体左移数组; 有效数据始终为缓冲区中连续的一段, data()与[-k:, :]仍返回视图
+    mirrored=False时保留原有的左移方式, 内存占用为一半
+    '''
+    def __init__(self, rowLen, colLen, dtype=np.float32, mirrored=True):
         assert rowLen > 0 and colLen > 0, "Invalid maximum length"
-        self.__values = np.empty((rowLen, colLen), dtype=dtype)
+        self.__mirrored = mirrored
+        self.__values = np.empty((rowLen * 2 if mirrored else rowLen, colLen), dtype=dtype)
         self.__colLen = colLen
         self.__maxLen = rowLen
-        self.__nextPos = [0]
+        self.__nextPos = [0, 0]  # [有效长度, 起始行], 与SliceDeque共享引用
 
     def getMaxLen(self):
         return self.__maxLen
 
+    def isMirrored(self):
+        return self.__mirrored
+
     def getPositionReference(self):
         return self.__nextPos
 
@@ -130,6 +228,21 @@ class NumpyPanelDeque(object):
         '''
         return SliceDeque(self.__values[:, idx], self.__nextPos, self.__maxLen)
 
+    def getSubDeque(self, start, stop):
+        '''
+        :param start: 起始列
+        :param stop: 终止列(不含)
+        :return: 与自身共享存储和位置引用的列区间队列, 用作多field数据块中单个field的视图,
+                 数据只能通过父队列append/update写入
+        '''
+        ret = NumpyPanelDeque.__new__(NumpyPanelDeque)
+        ret.__mirrored = self.__mirrored
+        ret.__values = self.__values[:, start:stop]
+        ret.__colLen = stop - start
+        ret.__maxLen = self.__maxLen
+        ret.__nextPos = self.__nextPos
+        return ret
+
     def append(self, value):
         '''
         :param value: arrayLike value
@@ -139,34 +252,58 @@ class NumpyPanelDeque(object):
         if self.__nextPos[0] < self.__maxLen:
             self.__values[self.__nextPos[0]] = value
             self.__nextPos[0] += 1
+        elif self.__mirrored:
+            # 新行写入窗口末尾, 同时写入其镜像行, 起始行走到缓冲区中点时回绕到0
+            start = self.__nextPos[1]
+            self.__values[start + self.__maxLen] = value
+            self.__values[start] = value
+            start += 1
+            self.__nextPos[1] = 0 if start == self.__maxLen else start
         else:
             # Shift items to the left and put the last value.
             # I'm not using np.roll to avoid creating a new array.
             self.__values[0:-1] = self.__values[1:]
             self.__values[self.__nextPos[0] - 1] = value
 
+    def extend(self, values):
+        '''
+        :param values: 二维数组, 每行为一次append的值, 一次性整块拷贝, 结果与逐行append相同
+        :return:
+        '''
+        values = np.asarray(values)[-self.__maxLen:]
+        assert values.ndim == 2 and values.shape[1] == self.__colLen
+        # 保留原有数据的末尾, 与新数据一起从缓冲区第0行开始重新排列, 位置引用原地修改以便共享的视图同步
+        keep = min(self.__nextPos[0], self.__maxLen - len(values))
+        lastValues = self.data()[self.__nextPos[0] - keep:].copy()
+        self.__values[0:keep] = lastValues
+        self.__values[keep:keep + len(values)] = values
+        self.__nextPos[0] = keep + len(values)
+        self.__nextPos[1] = 0
+
     def update(self, value):
-        if self.__nextPos == 0:
-            self.__values[self.__nextPos] = value
-            self.__nextPos += 1
+        if self.__nextPos[0] == 0:
+            self.__values[self.__nextPos[0]] = value
+            self.__nextPos[0] += 1
         else:
-            self.__values[self.__nextPos[0] -1] = value
+            last = self.__nextPos[1] + self.__nextPos[0] - 1
+            self.__values[last] = value
+            if self.__mirrored:
+                self.__values[last - self.__maxLen if last >= self.__maxLen else last + self.__maxLen] = value
 
     def data(self):
         # If all values are not initialized, return a portion of the array.
-        if self.__nextPos[0] < self.__maxLen:
-            ret = self.__values[0:self.__nextPos[0]]
-        else:
-            ret = self.__values
-        return ret
+        start = self.__nextPos[1]
+        return self.__values[start:start + self.__nextPos[0]]
 
     def resize(self, rowLen, colLen):
         assert rowLen > 0 and colLen > 0, "Invalid maximum length"
 
         # Create empty, copy last values and swap.
-        values = np.empty((rowLen, colLen), dtype=self.__values.dtype)
-        lastValues = self.__values[0:self.__nextPos[0]]
-        values[0:min(rowLen, len(lastValues)), 0: min(colLen, len(self.__colLen))] = lastValues[-1*min(rowLen, len(lastValues)):, 0: min(colLen, len(self.__colLen))]
+        values = np.empty((rowLen * 2 if self.__mirrored else rowLen, colLen), dtype=self.__values.dtype)
+        lastValues = self.data()
+        rowKeep = min(rowLen, len(lastValues))
+        colKeep = min(colLen, self.__colLen)
+        values[0:rowKeep, 0:colKeep] = lastValues[len(lastValues) - rowKeep:, 0:colKeep]
 
         if colLen > self.__colLen:
             values[:, self.__colLen:] = np.nan
@@ -174,8 +311,8 @@ class NumpyPanelDeque(object):
         self.__colLen = colLen
 
         self.__maxLen = rowLen
-        if self.__nextPos[0] >= self.__maxLen:
-            self.__nextPos[0] = self.__maxLen
+        self.__nextPos[0] = rowKeep
+        self.__nextPos[1] = 0
 
     def __len__(self):
         return self.__nextPos[0]
@@ -206,12 +343,9 @@ class SliceDeque(object):
         return self.__maxLen
 
     def data(self):
-        # If all values are not initialized, return a portion of the array.
-        if self.__nextPos[0] < self.__maxLen:
-            ret = self.__values[0:self.__nextPos[0]]
-        else:
-            ret = self.__values
-        return ret
+        # posPointer为[有效长度, 起始行], 与所属的NumpyPanelDeque同步
+        start = self.__nextPos[1]
+        return self.__values[start:start + self.__nextPos[0]]
 
     def __len__(self):
         return self.__nextPos[0]
@@ -28,7 +28,7 @@ class SequenceDataPanel:
         self.__colLen = len(colNames)
 
         self.__cols = np.array(colNames)
-        self.__dateTimes = collections.ListDeque(self.__maxLen) # rows
+        self.__dateTimes = collections.NumpyDateTimeDeque(self.__maxLen) # rows
         self.__values = collections.NumpyPanelDeque(self.__maxLen, len(colNames), dtype=dtype)
         self.__newValuesEvent = observer.Event()
         self.__updateValuesEvent = observer.Event()
@@ -56,7 +56,8 @@ class SequenceDataPanel:
         .. note::
             If dateTime is not None, it must be greater than the last one.
         """
-        if dateTime is not None and len(self.__dateTimes) != 0 and self.__dateTimes[-1] >= dateTime:
+        if dateTime is not None and len(self.__dateTimes) != 0 and \
+                self.__dateTimes.data()[-1] >= np.datetime64(dateTime, 'ns'):
             raise Exception("Invalid datetime. It must be bigger than that last one")
 
         assert(len(self.__values) == len(self.__dateTimes))
@@ -69,6 +70,45 @@ class SequenceDataPanel:
         self.__values.update(value)
         self.getUpdateValuesEvent().emit(self, dateTime, self.__values[-1])
 
+    def extendWithDateTimes(self, dateTimes, values):
+        '''
+        批量追加多行, 整块拷贝进队列, 不触发newValuesEvent, 用于加载静态数据
+        :param dateTimes: 严格递增的时间序列, 长度与values的行数相同
+        :param values: 时间 × colNames 的二维数组
+        '''
+        dateTimes = np.asarray(pd.DatetimeIndex(dateTimes).values, dtype='datetime64[ns]')
+        values = np.asarray(values)
+        assert len(dateTimes) == len(values)
+        if len(dateTimes) == 0:
+            return
+        if (np.diff(dateTimes) <= np.timedelta64(0, 'ns')).any() or \
+                (len(self.__dateTimes) != 0 and self.__dateTimes.data()[-1] >= dateTimes[0]):
+            raise Exception("Invalid datetime. It must be bigger than that last one")
+
+        assert(len(self.__values) == len(self.__dateTimes))
+        self.__dateTimes.extend(dateTimes)
+        self.__values.extend(values)
+
+    @classmethod
+    def from_array(cls, values, dateTimes, cols, maxLen=None, dtype=np.float32):
+        '''
+        :param values: 时间 × cols 的二维数组
+        :param dateTimes: 严格递增的时间序列
+        :param cols: 列名
+        :return: 一次性填充好的SequenceDataPanel, 超过maxLen时只保留最后maxLen行
+        '''
+        panel = cls(cols, maxLen=maxLen, dtype=dtype)
+        panel.extendWithDateTimes(dateTimes, values)
+        return panel
+
+    @classmethod
+    def from_frame(cls, df, maxLen=None, dtype=np.float32):
+        '''
+        :param df: 索引为时间, 列为codes的dataframe
+        :return: 一次性填充好的SequenceDataPanel
+        '''
+        return cls.from_array(df.values, df.index, df.columns, maxLen=maxLen, dtype=dtype)
+
     def resize(self, colNames):
         '''
         :param col:
@@ -83,10 +123,52 @@ class SequenceDataPanel:
         '''
         :return: 转换成datarame
         '''
-        return pd.DataFrame(self.__values[:], index=pd.to_datetime(self.__dateTimes[:]), columns=self.__cols)
+        return pd.DataFrame(self.__values[:], index=pd.DatetimeIndex(self.__dateTimes.data().copy()), columns=self.__cols)
 
     def getDateTimes(self):
-        return self.__dateTimes.data()
+        '''
+        :return: 时间戳队列本身(随数据更新), 整数索引返回Timestamp, 切片或np.asarray返回datetime64数组
+        '''
+        return self.__dateTimes
+
+    def searchDateTime(self, dateTime, side='left'):
+        '''
+        :param dateTime: 时间, 可为Timestamp/datetime/datetime64/字符串
+        :param side: 同np.searchsorted
+        :return: 在时间戳队列中二分查找的行位置
+        '''
+        return int(np.searchsorted(self.__dateTimes.data(), np.datetime64(pd.Timestamp(dateTime), 'ns'), side=side))
+
+    def asof(self, dateTime):
+        '''
+        :param dateTime:
+        :return: 时间不晚于dateTime的最后一行(视图), 不存在时返回None
+        '''
+        pos = self.searchDateTime(dateTime, side='right')
+        if pos == 0:
+            return None
+        return self.__values[pos - 1, :]
+
+    def between(self, start=None, end=None):
+        '''
+        :param start: 起始时间(含), None表示不限
+        :param end: 截止时间(含), None表示不限
+        :return: 时间处于[start, end]的行(视图)
+        '''
+        lo = 0 if start is None else self.searchDateTime(start, side='left')
+        hi = len(self.__values) if end is None else self.searchDateTime(end, side='right')
+        return self.__values[lo:max(lo, hi), :]
+
+    def window(self, delta):
+        '''
+        :param delta: timedelta或'30min'等, 以最新一行的时间为终点
+        :return: 时间处于(last - delta, last]的行(视图), 如最近30分钟
+        '''
+        if len(self.__values) == 0:
+            return self.__values[:, :]
+        last = self.__dateTimes.data()[-1]
+        lo = int(np.searchsorted(self.__dateTimes.data(), last - pd.Timedelta(delta).to_timedelta64(), side='right'))
+        return self.__values[lo:, :]
 
     def getColumnNames(self):
         '''
@@ -199,6 +281,109 @@ class SliceDataPanel(SequenceDataPanel):
         self._SequenceDataPanel__values = sourcePanel._SequenceDataPanel__values[:, indices]
 
 
+class SequenceDataBlock:
+    '''
+    (时间 × field × instrument) 三维数据块, 所有field共用一个时间戳队列, 相同dtype的field共用一块存储,
+    每个时刻每种dtype只需一次拷贝; getPanel(field)返回对应field的SequenceDataPanel视图(零拷贝),
+    视图的事件照常发送, 但数据只能通过数据块写入, 视图不支持resize
+    '''
+    def __init__(self, fields, colNames, maxLen=None, dtype=np.float32):
+        '''
+        :param fields: 字段名, 如OHLCV
+        :param colNames: instruments
+        :param dtype: 所有field统一的dtype, 或{field: dtype}, 未列出的field使用float32
+        '''
+        self.__maxLen = get_checked_max_len(maxLen)
+        self.__fields = list(fields)
+        self.__colLen = len(colNames)
+        if isinstance(dtype, dict):
+            fieldDtypes = [np.dtype(dtype.get(field, np.float32)) for field in self.__fields]
+        else:
+            fieldDtypes = [np.dtype(dtype)] * len(self.__fields)
+        self.__dtype = np.result_type(*fieldDtypes) if fieldDtypes else np.dtype(np.float32)
+
+        self.__dateTimes = collections.NumpyDateTimeDeque(self.__maxLen)
+        # 按dtype分组存储, 每组为 (组内field下标, 存储队列)
+        self.__groups = []
+        groupIdx = {}
+        for i, fieldDtype in enumerate(fieldDtypes):
+            groupIdx.setdefault(fieldDtype, []).append(i)
+        self.__panels = [None] * len(self.__fields)
+        for fieldDtype, idx in groupIdx.items():
+            values = collections.NumpyPanelDeque(self.__maxLen, len(idx) * self.__colLen, dtype=fieldDtype)
+            # 组内field连续时用切片, 避免append时的花式索引拷贝
+            rows = slice(idx[0], idx[-1] + 1) if idx[-1] - idx[0] + 1 == len(idx) else np.array(idx)
+            self.__groups.append((rows, len(idx), values))
+            for j, i in enumerate(idx):
+                panel = SequenceDataPanel(colNames, self.__maxLen, fieldDtype)
+                panel._SequenceDataPanel__dateTimes = self.__dateTimes
+                panel._SequenceDataPanel__values = values.getSubDeque(j * self.__colLen, (j + 1) * self.__colLen)
+                self.__panels[i] = panel
+
+    def getMaxLen(self):
+        return self.__maxLen
+
+    def getFields(self):
+        return self.__fields
+
+    def getPanel(self, field):
+        return self.__panels[self.__fields.index(field)]
+
+    def getDateTimes(self):
+        return self.__dateTimes
+
+    def getDtype(self):
+        return self.__dtype
+
+    def toArray(self, valueDict):
+        '''
+        :param valueDict: {field: 一维数组}
+        :return: 按fields顺序组成的 field × instrument 数组, 缺失的field填充nan, dtype为各field dtype的公共类型
+        '''
+        ret = np.full((len(self.__fields), self.__colLen), np.nan, dtype=self.__dtype)
+        for i, field in enumerate(self.__fields):
+            if field in valueDict:
+                ret[i] = valueDict[field]
+        return ret
+
+    def appendWithDateTime(self, dateTime, values):
+        '''
+        :param values: field × instrument 数组, 行与fields对齐, 列与instruments对齐
+        '''
+        if dateTime is not None and len(self.__dateTimes) != 0 and \
+                self.__dateTimes.data()[-1] >= np.datetime64(dateTime, 'ns'):
+            raise Exception("Invalid datetime. It must be bigger than that last one")
+
+        self.__dateTimes.append(dateTime)
+        values = np.asarray(values).reshape(len(self.__fields), self.__colLen)
+        for rows, _, groupValues in self.__groups:
+            groupValues.append(values[rows].reshape(-1))
+        for panel in self.__panels:
+            panel.getNewValuesEvent().emit(panel, dateTime, panel[-1, :])
+
+    def updateWithDateTime(self, dateTime, values):
+        self.__dateTimes.updateLast(dateTime)
+        values = np.asarray(values).reshape(len(self.__fields), self.__colLen)
+        for rows, _, groupValues in self.__groups:
+            groupValues.update(values[rows].reshape(-1))
+        for panel in self.__panels:
+            panel.getUpdateValuesEvent().emit(panel, dateTime, panel[-1, :])
+
+    def data(self):
+        '''
+        :return: 时间 × field × instrument 数组, 只有一种dtype时为视图, 否则为按公共dtype拼接的拷贝
+        '''
+        if len(self.__groups) == 1:
+            return self.__groups[0][2].data().reshape(-1, len(self.__fields), self.__colLen)
+        ret = np.empty((len(self), len(self.__fields), self.__colLen), dtype=self.__dtype)
+        for rows, groupLen, groupValues in self.__groups:
+            ret[:, rows, :] = groupValues.data().reshape(-1, groupLen, self.__colLen)
+        return ret
+
+    def __len__(self):
+        return len(self.__dateTimes)
+
+
 class SequenceDataSeries(dataseries.SequenceDataSeries):
     """A DataSeries that holds values in a sequence in memory.
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from cpa.io.h5Writer import H5PanelSink, H5PanelWriter
+from cpa.utils import series
+
+
+def makeFrame(start, periods, columns):
+    index = pd.date_range(start, periods=periods, freq="min")
+    return pd.DataFrame(np.random.random((periods, len(columns))), index=index, columns=columns)
+
+
+def appendFile(data, oldFilePath, newFilePath):
+    writer = H5PanelWriter.__new__(H5PanelWriter)  # appendFile不依赖因子检测对象
+    return writer.appendFile(data, oldFilePath, newFilePath)
+
+
+def test_append_same_columns(tmp_path):
+    old = makeFrame("2020-01-01 09:31", 10, ["000001", "000002"])
+    path = str(tmp_path / "f_factor_1min_1.h5")
+    old.to_hdf(path, key="f", format="table", data_columns=True, mode="w")
+    new = makeFrame("2020-01-01 09:35", 10, ["000001", "000002"])
+    newPath = str(tmp_path / "f_factor_1min_2.h5")
+
+    assert appendFile(new, path, newPath)
+    result = pd.read_hdf(newPath, key="f")
+    expected = pd.concat([old, new[new.index > old.index[-1]]])
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+
+
+def test_append_changed_columns(tmp_path):
+    old = makeFrame("2020-01-01 09:31", 10, ["000001", "000002", "000003"])
+    path = str(tmp_path / "f_factor_1min_1.h5")
+    old.to_hdf(path, key="f", format="table", data_columns=True, mode="w")
+
+    # 股票退市且列顺序变化: 按已存储的列对齐后直接追加
+    delisted = makeFrame("2020-01-01 09:35", 10, ["000003", "000001"])
+    assert appendFile(delisted, path, path)
+    result = pd.read_hdf(path, key="f")
+    assert list(result.columns) == ["000001", "000002", "000003"]
+    assert len(result) == 14
+    np.testing.assert_array_equal(result["000001"].values[10:], delisted["000001"].values[6:])
+    assert result["000002"].iloc[10:].isna().all()
+
+    # 出现新股票: 读取后拼接重写
+    listed = makeFrame("2020-01-01 09:40", 10, ["000001", "000004"])
+    assert appendFile(listed, path, path)
+    result = pd.read_hdf(path, key="f")
+    assert list(result.columns) == ["000001", "000002", "000003", "000004"]
+    assert len(result) == 19
+    np.testing.assert_array_equal(result["000004"].values[14:], listed["000004"].values[5:])
+    assert result["000004"].iloc[:14].isna().all()
+    np.testing.assert_array_equal(result["000001"].values[:10], old["000001"].values)
+
+
+def test_append_series(tmp_path):
+    index = pd.date_range("2020-01-01 09:31", periods=10, freq="min")
+    old = pd.Series(np.random.random(10), index=index)
+    path = str(tmp_path / "f_IC_1min_1.h5")
+    old.to_hdf(path, key="IC", format="table", data_columns=True, mode="w")
+    new = pd.Series(np.random.random(10), index=index + pd.Timedelta(minutes=5))
+
+    assert appendFile(new, path, path)
+    assert len(pd.read_hdf(path, key="IC")) == 15
+
+
+def test_append_from_sink_beyond_maxLen(tmp_path):
+    old = makeFrame("2020-01-01 09:31", 10, ["000001", "000002"]).astype(np.float32)
+    path = str(tmp_path / "f_factor_1min_1.h5")
+    old.to_hdf(path, key="f", format="table", data_columns=True, mode="w")
+
+    # panel只保留5行, 追加的数据来自sink的临时文件, 不受maxLen限制
+    panel = series.SequenceDataPanel(["000001", "000002"], maxLen=5)
+    sinkPath = str(tmp_path / "f_factor_1min.tmp")
+    sink = H5PanelSink(panel, sinkPath, key="f", chunkSize=4)
+    new = makeFrame("2020-01-01 09:35", 30, ["000001", "000002"])
+    for dateTime, values in zip(new.index, new.values):
+        panel.appendWithDateTime(dateTime.to_pydatetime(), values)
+
+    writer = H5PanelWriter.__new__(H5PanelWriter)
+    writer.factorSink = sink
+    data = writer.getSinkData()
+    assert len(data) == 30
+    assert writer.appendFile(data, path, path)
+    result = pd.read_hdf(path, key="f")
+    assert len(result) == 34
+    np.testing.assert_array_equal(result.values[10:], new.values[6:].astype(np.float32))
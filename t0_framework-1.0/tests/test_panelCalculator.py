@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from cpa.calculator import panelCalculator
+
+
+def smaBaseline(x, n, m):
+    '''
+    原有的逐行计算, 权值依次对应窗口内从早到晚的各行
+    '''
+    num = n - m + 1
+    x = x[-num:, :]
+    alpha1 = np.zeros(num)
+    alpha2 = np.zeros(num)
+    alpha1[0] = 1
+    for i in range(1, num):
+        alpha1[i] = alpha1[i - 1] * (n - (i - 1) - m) / (n - (i - 1))
+    for i in range(num):
+        alpha2[i] = m / (n - i)
+    return (x.T * (alpha1 * alpha2)).T.sum(axis=0)
+
+
+def decaylinearBaseline(x, n):
+    x = x[-n:, :]
+    alpha = np.arange(1, n + 1) / (n * (n + 1) / 2)
+    return (x.T * alpha).T.sum(axis=0)
+
+
+@pytest.mark.parametrize("n, m", [(12, 2), (5, 1), (3, 3), (20, 7)])
+def test_sma_keeps_weight_order(n, m):
+    x = np.random.default_rng(n).normal(10, 2, (30, 6))
+    x[3, 2] = np.nan
+    np.testing.assert_allclose(panelCalculator.Sma(x, n, m), smaBaseline(x, n, m), rtol=1e-12)
+    # 窗口内最早一行的权值为m/n
+    assert panelCalculator.SmaWeights(n, m)[0] == m / n
+
+
+@pytest.mark.parametrize("n", [1, 4, 9])
+def test_decaylinear_matches_baseline(n):
+    x = np.random.default_rng(n).normal(10, 2, (30, 6))
+    np.testing.assert_allclose(panelCalculator.Decaylinear(x, n), decaylinearBaseline(x, n), rtol=1e-12)
+
+
+def test_short_window_raises():
+    x = np.ones((3, 4))
+    with pytest.raises(ValueError):
+        panelCalculator.Decaylinear(x, 5)
+    with pytest.raises(ValueError):
+        panelCalculator.Sma(x, 10, 2)
+    with pytest.raises(ValueError):
+        panelCalculator.Wma(x, 5, 0.9, 'exp')
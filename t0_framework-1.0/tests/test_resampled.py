@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from cpa.feed.baseFeed import PanelFeed
+from cpa.resample.resampled import ResampledPanelFeed
+from cpa.utils import bar
+
+
+class InlineReader:
+    '''
+    逐分钟输出 field × instrument 数组的内存数据源
+    '''
+
+    def __init__(self, dateTimes, values, fields):
+        self.dateTimes = dateTimes
+        self.values = values
+        self.fields = fields
+        self.pos = 0
+
+    def getNextValues(self):
+        self.pos += 1
+        return self.dateTimes[self.pos - 1], self.values[self.pos - 1]
+
+    def eof(self):
+        return self.pos >= len(self.dateTimes)
+
+
+def test_resampled_extra_fields_and_dtypes():
+    fields = ['open', 'high', 'low', 'close', 'volume', 'amount']
+    instruments = ['000001', '000002', '000003']
+    dateTimes = [datetime.datetime(2020, 1, 2, 9, 31) + datetime.timedelta(minutes=i) for i in range(30)]
+    rng = np.random.default_rng(0)
+    values = rng.random((len(dateTimes), len(fields), len(instruments))) * 10
+    values[:, 4] = rng.integers(1, 10 ** 6, (len(dateTimes), len(instruments))) * 100 + 2 ** 25  # 超出float32精度
+    values[:, 5] = values[:, 4] * 10.01
+
+    feed = PanelFeed(InlineReader(dateTimes, values, fields), instruments, maxLen=100)
+    resampled = ResampledPanelFeed(feed, bar.Frequency.MINUTE5)
+    feed.run()
+
+    assert len(resampled) > 0
+    assert resampled.closePanel.getDtype() == np.float32
+    assert resampled.volumePanel.getDtype() == np.float64
+    # 额外字段不参与重采样, 每根K线写入一行nan, 与K线的时间对齐, dtype与PanelFeed一致为float64
+    amount = resampled.getExtra('amount')
+    assert amount.getDtype() == np.float64
+    assert len(amount) == len(resampled.closePanel)
+    assert np.isnan(amount[:, :]).all()
+
+    # 成交量按float64累加, 不丢失精度
+    frame = pd.DataFrame(values[:, 4], index=pd.DatetimeIndex(dateTimes), columns=instruments)
+    close = resampled.closePanel.to_frame()
+    first = close.index[0]
+    expected = frame[frame.index <= first].sum().values
+    np.testing.assert_array_equal(resampled.volumePanel[0, :], expected)
+    np.testing.assert_array_equal(feed.volumePanel[:, :], values[-len(feed.volumePanel):, 4])
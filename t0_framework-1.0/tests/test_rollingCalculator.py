@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import warnings
+
+import numpy as np
+
+from cpa.calculator import panelCalculator
+from cpa.calculator.rollingCalculator import RollingMoments
+
+
+def test_moments_constant_window():
+    warnings.filterwarnings("ignore", category=RuntimeWarning)
+    rng = np.random.default_rng(0)
+    num, T = 10, 120
+    x = rng.normal(0, 100, (T, 4))
+    # 各列在不同时间段取常数, 包括0和较大的值; 常数段的起点与重算不对齐, 之前的随机值在幂和中留下误差
+    x[33:63, 0] = 3.0
+    x[47:90, 1] = 0.0
+    x[73:, 2] = 1e6
+    x[41:55, 3] = -2.5
+
+    rolling = RollingMoments(num, order=4)
+    for t in range(T):
+        rolling.update(x[t])
+        if t % 5 == 2:  # 最新一行被修改
+            rolling.replace(rng.normal(0, 100, 4))
+            rolling.replace(x[t])
+        if t < num - 1:
+            continue
+        skew, kurt = rolling.skew(), rolling.kurt()
+        expectedSkew = panelCalculator.Skew(x[:t + 1], num)
+        expectedKurt = panelCalculator.Kurt(x[:t + 1], num)
+        flat = np.ptp(x[t + 1 - num:t + 1], axis=0) == 0
+        assert np.isnan(expectedSkew[flat]).all() and np.isnan(expectedKurt[flat]).all()
+        np.testing.assert_array_equal(np.isnan(skew), np.isnan(expectedSkew))
+        np.testing.assert_array_equal(np.isnan(kurt), np.isnan(expectedKurt))
+        np.testing.assert_allclose(skew[~flat], expectedSkew[~flat], rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(kurt[~flat], expectedKurt[~flat], rtol=1e-6, atol=1e-8)